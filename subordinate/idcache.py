@@ -0,0 +1,165 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdCache class definition."""
+
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from subordinate.utils import subordinate_stat_key
+
+class IdCache(object):
+    """
+    IdCache(cache_dir) -> IdCache object
+
+    Returns a store of parsed id files kept in the directory cache_dir.
+    Each id file has a compact binary cache file holding its names and its
+    ranges, which is used as long as the device, the inode, the size and
+    the modification time of the id file are unchanged. The directory
+    must only be writable by trusted users.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self, cache_dir):
+        """
+        Constructor method.
+        The cache files are stored in the directory cache_dir which is
+        created when needed.
+        """
+
+        if not isinstance(cache_dir, str):
+            raise TypeError(
+                    "{}() argument 'cache_dir' must be a string, "
+                    "not {}".format(
+                        self.__class__.__name__,
+                        cache_dir.__class__.__name__
+                        )
+                    )
+
+        self.__dir = cache_dir
+
+    # Special methods
+    #################
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}({!r})".format(self.__class__.__name__, self.__dir)
+
+    # Miscellaneous
+    ###############
+
+    # File signature, followed by the byte order of the arrays
+    MAGIC = b'SUBIDC1' + sys.byteorder[0].encode()
+
+    # Device, inode, size and modification time of the id file, then the
+    # size of the names and the number of ranges
+    HEADER = struct.Struct('<QQQqQQ')
+
+    __slots__ = ['_IdCache__dir']
+
+    # Public methods
+    ################
+
+    def load(self, id_filename, id_stat):
+        """
+        Return the tuple (names, firsts, counts) cached for the id file
+        id_filename whose current status is id_stat, as given by os.stat,
+        or None if there is no fresh cache for it. The tuple is formatted
+        as the result of subordinate.idparser.parse_file.
+        """
+
+        try:
+            with open(self.path(id_filename), 'rb') as cache_file:
+                data = cache_file.read()
+        except OSError:
+            return None
+
+        start = len(self.MAGIC) + self.HEADER.size
+        if len(data) < start or not data.startswith(self.MAGIC):
+            return None
+
+        header = self.HEADER.unpack_from(data, len(self.MAGIC))
+        names_size, nranges = header[4:]
+        if (header[:4] != subordinate_stat_key(id_stat) or
+                len(data) != start + names_size + 16 * nranges):
+            return None
+
+        names = [data[start:start+names_size]] if nranges else []
+        start += names_size
+        firsts = array('Q')
+        firsts.frombytes(data[start:start+8*nranges])
+        counts = array('Q')
+        counts.frombytes(data[start+8*nranges:])
+
+        return names, firsts, counts
+
+    def path(self, id_filename):
+        """Return the path of the cache file of the id file id_filename."""
+
+        id_path = os.path.abspath(id_filename)
+        digest = hashlib.sha1(os.fsencode(id_path)).hexdigest()
+
+        return os.path.join(
+                self.__dir,
+                '{}-{}.cache'.format(os.path.basename(id_path), digest[:16])
+                )
+
+    def save(self, id_filename, id_stat, parsed):
+        """
+        Store parsed, a tuple (names, firsts, counts) as returned by
+        subordinate.idparser.parse_file, as the cache of the id file
+        id_filename whose status is id_stat. Return True on success and
+        False if the cache file cannot be written.
+        """
+
+        names, firsts, counts = parsed
+        names = b'\n'.join(names)
+        header = subordinate_stat_key(id_stat) + (len(names), len(firsts))
+
+        try:
+            os.makedirs(self.__dir, exist_ok=True)
+            fd, tmp_filename = tempfile.mkstemp(
+                    prefix='.tmp-',
+                    dir=self.__dir
+                    )
+        except OSError:
+            return False
+
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(self.MAGIC)
+                cache_file.write(self.HEADER.pack(*header))
+                cache_file.write(names)
+                cache_file.write(firsts.tobytes())
+                cache_file.write(counts.tobytes())
+            os.chmod(tmp_filename, 0o644)
+            os.replace(tmp_filename, self.path(id_filename))
+        except OSError:
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+            return False
+
+        return True
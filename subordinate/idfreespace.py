@@ -0,0 +1,229 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdFreeSpace class definition."""
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from subordinate.utils import subordinate_no_del, subordinate_no_set
+
+class IdFreeSpace(object):
+    """
+    IdFreeSpace(gaps, id_min, id_max, cursor=None) -> IdFreeSpace object
+
+    Returns the free extents between the ids id_min and id_max given by
+    gaps, an iterable of sorted and disjoint tuples (first, count). Ids
+    are allocated at the start of the extents. First and next fit search
+    and update a tree of their maximal sizes in O(log n). Best fit
+    searches a list of the extents sorted by size in O(log n) but moves
+    its tail to keep it sorted, which is O(n) in the worst case.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self, gaps, id_min, id_max, cursor=None):
+        """
+        Constructor method.
+        The extents of gaps are clipped to the ids from id_min to id_max.
+        The next fit policy starts searching from the id cursor, id_min if
+        it is None.
+        """
+
+        starts = array('Q')
+        sizes = []
+        for first, count in gaps:
+            last = min(first + count - 1, id_max)
+            first = max(first, id_min)
+            if first <= last:
+                starts.append(first)
+                sizes.append(last - first + 1)
+
+        leaves = 1
+        while leaves < len(sizes):
+            leaves *= 2
+        tree = [0] * leaves + sizes + [0] * (leaves - len(sizes))
+        for i in range(leaves - 1, 0, -1):
+            tree[i] = max(tree[2*i], tree[2*i+1])
+
+        self.__by_size = sorted((size, i) for i, size in enumerate(sizes))
+        self.__cursor = id_min if cursor is None else cursor
+        self.__id_max = id_max
+        self.__id_min = id_min
+        self.__leaves = leaves
+        self.__sizes = sizes
+        self.__starts = starts
+        self.__tree = tree
+
+    # Special methods
+    #################
+
+    def __len__(self):
+        """Return the number of free extents."""
+
+        return len(self.__by_size)
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}({}, {})".format(
+                self.__class__.__name__,
+                self.__id_min,
+                self.__id_max
+                )
+
+    # Miscellaneous
+    ###############
+
+    # Allocation policies
+    POLICIES = ('first', 'best', 'next')
+
+    __slots__ = [
+            '_IdFreeSpace__by_size',
+            '_IdFreeSpace__cursor',
+            '_IdFreeSpace__id_max',
+            '_IdFreeSpace__id_min',
+            '_IdFreeSpace__leaves',
+            '_IdFreeSpace__sizes',
+            '_IdFreeSpace__starts',
+            '_IdFreeSpace__tree'
+            ]
+
+    # Private methods
+    #################
+
+    def __leftmost(self, count, lo):
+        """
+        Return the index of the leftmost extent from lo with at least count
+        ids, or -1 if there is none.
+        """
+
+        tree = self.__tree
+        if lo >= len(self.__sizes):
+            return -1
+
+        i = lo + self.__leaves
+        while True:
+            if tree[i] >= count:
+                # Go down to the leftmost large enough leaf
+                while i < self.__leaves:
+                    i = 2*i if tree[2*i] >= count else 2*i + 1
+                return i - self.__leaves
+
+            # Go to the next subtree on the right
+            while i & 1:
+                i >>= 1
+            if i == 0:
+                return -1
+            i += 1
+
+    def __take(self, i, count):
+        """Allocate count ids at the start of the extent i."""
+
+        size = self.__sizes[i]
+        del self.__by_size[bisect_left(self.__by_size, (size, i))]
+        if size > count:
+            insort(self.__by_size, (size - count, i))
+
+        self.__sizes[i] = size - count
+        self.__starts[i] += count
+
+        j = i + self.__leaves
+        self.__tree[j] = size - count
+        while j > 1:
+            j >>= 1
+            self.__tree[j] = max(self.__tree[2*j], self.__tree[2*j+1])
+
+    # Public methods
+    ################
+
+    def allocate(self, count, policy='first'):
+        """
+        Allocate count consecutive ids in an extent chosen according to
+        policy: 'first' takes the lowest extent large enough, 'best' the
+        smallest one and 'next' the first one from the cursor, the id
+        following the previous allocation, wrapping around to the lowest
+        one. Return the first allocated id or None if no extent is large
+        enough.
+        """
+
+        if policy not in self.POLICIES:
+            raise ValueError(
+                    "policy must be one of {}, not {!r}".format(
+                        ', '.join(self.POLICIES),
+                        policy
+                        )
+                    )
+
+        if policy == 'best':
+            j = bisect_left(self.__by_size, (count, -1))
+            i = self.__by_size[j][1] if j < len(self.__by_size) else -1
+        elif policy == 'next':
+            # Start from the extent holding the cursor or the next one
+            lo = bisect_right(self.__starts, self.__cursor) - 1
+            if lo < 0 or (
+                    self.__starts[lo] + self.__sizes[lo] <= self.__cursor
+                    ):
+                lo += 1
+            i = self.__leftmost(count, lo)
+            if i < 0:
+                i = self.__leftmost(count, 0)
+        else:
+            i = self.__leftmost(count, 0)
+
+        if i < 0:
+            return None
+
+        first = self.__starts[i]
+        self.__take(i, count)
+        self.__cursor = first + count
+
+        return first
+
+    def extents(self):
+        """Return the list of the free extents as tuples (first, count)."""
+
+        return [
+                (first, size)
+                for first, size in zip(self.__starts, self.__sizes)
+                if size
+                ]
+
+    # Properties
+    ############
+
+    cursor = property(
+            lambda self: self.__cursor,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'cursor'"
+            )
+
+    id_max = property(
+            lambda self: self.__id_max,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'id_max'"
+            )
+
+    id_min = property(
+            lambda self: self.__id_min,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'id_min'"
+            )
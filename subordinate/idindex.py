@@ -0,0 +1,443 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdIndex class definition."""
+
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+from itertools import accumulate, islice, repeat
+from operator import add, lt
+
+from subordinate.idfreespace import IdFreeSpace
+from subordinate.utils import (
+        subordinate_id_array, subordinate_int, subordinate_no_del,
+        subordinate_no_set, subordinate_numpy
+        )
+
+class IdIndex(object):
+    """
+    IdIndex() -> IdIndex object
+
+    Returns a reverse index from ids to the names owning them. The id
+    space is cut into elementary segments at the bounds of all the ranges
+    of a map and each segment knows the names covering it, so that the
+    owners of an id are found by a binary search on the segment bounds.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self):
+        """
+        Constructor method.
+        On create, the index is empty and invalid.
+        """
+
+        self.__bounds = []
+        self.__bounds_array = None
+        self.__cursor = None
+        self.__free = None
+        self.__owners = []
+        self.__sets = {}
+        self.__valid = False
+
+    # Special methods
+    #################
+
+    def __len__(self):
+        """Return the number of segments in the index."""
+
+        return len(self.__bounds)
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}()".format(self.__class__.__name__)
+
+    # Miscellaneous
+    ###############
+
+    __slots__ = [
+            '_IdIndex__bounds',
+            '_IdIndex__bounds_array',
+            '_IdIndex__cursor',
+            '_IdIndex__free',
+            '_IdIndex__owners',
+            '_IdIndex__sets',
+            '_IdIndex__valid'
+            ]
+
+    # Private methods
+    #################
+
+    def __coalesce(self, i, j):
+        """
+        Merge the segments from i to j with the previous segment when
+        they have the same owners, nobody owning the ids before the first
+        segment.
+        """
+
+        bounds = self.__bounds
+        owners = self.__owners
+        for k in range(min(j, len(bounds) - 1), i - 1, -1):
+            if owners[k] == (owners[k-1] if k else ()):
+                del bounds[k]
+                del owners[k]
+
+    def __insert(self, name, first, count):
+        """
+        Record that name owns the count ids from first which must be free
+        in the index, even if they span several segments.
+        """
+
+        self.__bounds_array = None
+        i = self.__split(first)
+        j = self.__split(first + count)
+        self.__bounds[i:j] = [first]
+        self.__owners[i:j] = [(name,)]
+        self.__coalesce(i, i + 1)
+
+    def __split(self, position):
+        """
+        Make position a bound of the index, splitting the segment around
+        it if needed, and return the index of the segment starting there.
+        """
+
+        bounds = self.__bounds
+        i = bisect_left(bounds, position)
+        if i == len(bounds) or bounds[i] != position:
+            bounds.insert(i, position)
+            self.__owners.insert(i, self.__owners[i-1] if i else ())
+
+        return i
+
+    # Protected methods
+    ###################
+
+    def _segments(self):
+        """
+        Return the list of the segment bounds of the index and the list of
+        the tuples of the names owning each segment. They must not be
+        modified.
+        """
+
+        return self.__bounds, self.__owners
+
+    # Public methods
+    ################
+
+    def allocate(self, name, count, id_min, id_max, policy='first'):
+        """
+        Find count consecutive free ids between id_min and id_max according
+        to policy (see IdFreeSpace) and record them as owned by name. The
+        free extents are kept from an allocation to the next one as long
+        as the bounds do not change, and the cursor of the next fit policy
+        even when they do. Return the first id or None if there is no
+        room. The index must be valid.
+        """
+
+        free = self.__free
+        if free is None or free.id_min != id_min or free.id_max != id_max:
+            free = self.__free = IdFreeSpace(
+                    self.gaps(id_min, id_max),
+                    id_min, id_max,
+                    self.__cursor
+                    )
+
+        first = free.allocate(count, policy)
+        if first is not None:
+            self.__cursor = free.cursor
+            self.__insert(name, first, count)
+
+        return first
+
+    def gaps(self, id_min=0, id_max=None):
+        """
+        Generate the sorted tuples (first, count) of the extents of ids
+        owned by nobody between id_min and id_max. The last extent has no
+        end if id_max is None.
+        """
+
+        previous = id_min
+        for bound, names in zip(self.__bounds, self.__owners):
+            if id_max is not None and bound > id_max:
+                break
+            if names:
+                if previous is not None and previous < bound:
+                    yield previous, bound - previous
+                previous = None
+            elif previous is None:
+                previous = max(bound, id_min)
+
+        if previous is not None:
+            if id_max is None:
+                yield previous, None
+            elif previous <= id_max:
+                yield previous, id_max - previous + 1
+
+    def invalidate(self):
+        """
+        Mark the index as out of date. This method is called by the
+        IdRangeSet objects watched by the index each time they change.
+        """
+
+        self.__free = None
+        self.__valid = False
+
+    def rebuild(self, id_map):
+        """
+        Build the index from id_map, a mapping between names and IdRangeSet
+        objects. The names covering a segment are listed in the iteration
+        order of id_map.
+        """
+
+        names = []
+        ranks = []
+        firsts = []
+        ends = []
+        sets = {}
+        for name, id_range_set in id_map.items():
+            # The merged ranges of a name do not overlap nor touch
+            set_firsts, set_counts = id_range_set._merged_columns()
+            ranks.extend(repeat(len(names), len(set_firsts)))
+            firsts.extend(set_firsts)
+            ends.extend(map(add, set_firsts, set_counts))
+            sets[id(id_range_set)] = id_range_set, name
+            names.append(name)
+
+        # Sort the ranges by first id, a range starting before the end of
+        # a previous one joins its cluster
+        order = sorted(range(len(firsts)), key=firsts.__getitem__)
+        firsts = [firsts[i] for i in order]
+        ends = [ends[i] for i in order]
+        ranks = [ranks[i] for i in order]
+        next_joins = list(
+                map(lt, islice(firsts, 1, None), accumulate(ends, max))
+                )
+        next_joins.append(False)
+
+        bounds = []
+        owners = []
+
+        def cut(position, active):
+            """Start a segment at position owned by the active ranges."""
+
+            segment_names = tuple(
+                    names[rank] for rank in sorted(rank for _, rank in active)
+                    )
+            if bounds and bounds[-1] == position:
+                # The previous segment is empty
+                owners[-1] = segment_names
+                if len(owners) > 1 and owners[-2] == segment_names:
+                    del bounds[-1]
+                    del owners[-1]
+            elif not owners or owners[-1] != segment_names:
+                bounds.append(position)
+                owners.append(segment_names)
+
+        # Sweep the ranges, a range alone is owned by its name only which
+        # cannot own the range ending at its first id
+        alone = [(name,) for name in names]
+        stop = None
+        active = []
+        for first, end, rank, next_joined in zip(
+                firsts, ends, ranks, next_joins
+                ):
+            if not active and not next_joined:
+                if first == stop:
+                    owners[-1] = alone[rank]
+                else:
+                    bounds.append(first)
+                    owners.append(alone[rank])
+                bounds.append(end)
+                owners.append(())
+                stop = end
+                continue
+
+            # Cut a cluster at the bounds of its ranges, active is a heap of
+            # the ranges covering the current position
+            while active and active[0][0] <= first:
+                stop = heappop(active)[0]
+                while active and active[0][0] == stop:
+                    heappop(active)
+                cut(stop, active)
+            heappush(active, (end, rank))
+            cut(first, active)
+            if not next_joined:
+                while active:
+                    stop = heappop(active)[0]
+                    while active and active[0][0] == stop:
+                        heappop(active)
+                    cut(stop, active)
+
+        self.__bounds = bounds
+        self.__bounds_array = None
+        self.__owners = owners
+        self.__sets = sets
+        self.__valid = True
+
+    def update(self, id_range_set, first, count, added):
+        """
+        Record that the count ids from first were added to id_range_set if
+        added is True, else removed from it. This method is called by the
+        IdRangeSet objects watched by the index instead of invalidate when
+        a single range changes. The segments are updated in place if the
+        index is valid, id_range_set is known since the last rebuild and
+        the added ids are owned by nobody, else the index is invalidated.
+        """
+
+        entry = self.__sets.get(id(id_range_set))
+        if not self.__valid or entry is None or entry[0] is not id_range_set:
+            self.invalidate()
+            return
+        name = entry[1]
+
+        bounds = self.__bounds
+        owners = self.__owners
+        end = first + count
+        if added:
+            i = max(bisect_right(bounds, first) - 1, 0)
+            if any(owners[i:bisect_left(bounds, end)]):
+                self.invalidate()
+                return
+            i = self.__split(first)
+            j = self.__split(end)
+            bounds[i:j] = [first]
+            owners[i:j] = [(name,)]
+            self.__coalesce(i, i + 1)
+        else:
+            i = self.__split(first)
+            j = self.__split(end)
+            owners[i:j] = [
+                    tuple(other for other in names if other != name)
+                    for names in owners[i:j]
+                    ]
+            self.__coalesce(i, j)
+
+        self.__bounds_array = None
+        self.__free = None
+
+    def usage(self, id_min, id_max):
+        """
+        Return a tuple (allocated, shared, free, largest) where allocated
+        is the number of ids owned by at least one name, shared the number
+        of ids owned by several names, free the number of ids owned by
+        nobody between id_min and id_max and largest the size of the
+        largest extent of them. The segments are visited once.
+        """
+
+        limit = id_max + 1
+        bounds = self.__bounds
+        ends = bounds + [max(limit, bounds[-1] if bounds else 0)]
+
+        allocated = shared = free = largest = 0
+        start = 0
+        names = ()
+        for end, next_names in zip(ends, self.__owners + [()]):
+            if names:
+                allocated += end - start
+                if len(names) > 1:
+                    shared += end - start
+            else:
+                # Nobody owns the segment, count its ids within the bounds
+                size = min(end, limit) - max(start, id_min)
+                if size > 0:
+                    free += size
+                    largest = max(largest, size)
+            start, names = end, next_names
+
+        return allocated, shared, free, largest
+
+    def who_has(self, subid):
+        """Return a list of names who own subid according to the index."""
+
+        if not isinstance(subid, int):
+            return []
+
+        i = bisect_right(self.__bounds, subid) - 1
+        if i < 0:
+            return []
+
+        return list(self.__owners[i])
+
+    def who_has_many(self, ids):
+        """
+        Return a list holding, for each id of the sequence ids, the tuple
+        of the names who own it according to the index. With NumPy, all
+        the ids are searched in the segment bounds at once.
+        """
+
+        # The owners of the segment ending at a bound, nobody before the
+        # first one
+        table = [()] + self.__owners
+
+        converted = subordinate_id_array(ids)
+        if converted is None:
+            bounds = self.__bounds
+            return [
+                    () if subid is None else table[bisect_right(bounds, subid)]
+                    for subid in map(subordinate_int, ids)
+                    ]
+        id_array, valid = converted
+
+        if self.__bounds_array is None:
+            # A bound past the last id only ends the last segment
+            bounds = self.__bounds
+            if bounds and bounds[-1] >> 64:
+                bounds = bounds[:-1]
+            self.__bounds_array = subordinate_numpy().array(
+                    bounds,
+                    dtype='uint64'
+                    )
+        positions = self.__bounds_array.searchsorted(id_array, 'right')
+        if valid is not None:
+            # Nobody owns the negative ids
+            positions[~valid] = 0
+
+        return list(map(table.__getitem__, positions.tolist()))
+
+    def who_overlaps(self, first, count):
+        """
+        Return a list of the names who own at least one of the count
+        consecutive ids starting at id first according to the index, in
+        the order of their first owned id in the range. Only the segments
+        overlapping the range are visited.
+        """
+
+        if count < 1:
+            return []
+
+        end = first + count
+        bounds = self.__bounds
+        names = {}
+        i = max(bisect_right(bounds, first) - 1, 0)
+        while i < len(bounds) and bounds[i] < end:
+            for name in self.__owners[i]:
+                names[name] = None
+            i += 1
+
+        return list(names)
+
+    # Properties
+    ############
+
+    valid = property(
+            lambda self: self.__valid,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'valid'"
+            )
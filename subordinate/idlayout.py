@@ -0,0 +1,188 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdLayout class definition and formatting of its extents."""
+
+from subordinate.utils import subordinate_no_del, subordinate_no_set
+
+# The ids of the kernel are 32 bits integers and (uid_t) -1 is not an id
+ID_LIMIT = (1 << 32) - 1
+
+class IdLayout(object):
+    """
+    IdLayout(id_range_set) -> IdLayout object
+
+    Returns the layouts of blocks of consecutive ids of a user namespace
+    onto the ranges of id_range_set, as written in '/proc/<pid>/uid_map'
+    or given to newuidmap. A layout has as few extents as possible since
+    the largest ranges of the set are used first. The layouts are cached
+    by size until the set changes.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self, id_range_set):
+        """
+        Constructor method.
+        The layout watches id_range_set until it is released.
+        """
+
+        self.__layouts = {}
+        self.__set = id_range_set
+        id_range_set._add_watcher(self)
+
+    # Special methods
+    #################
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}()".format(self.__class__.__name__)
+
+    # Miscellaneous
+    ###############
+
+    __slots__ = [
+            '_IdLayout__layouts',
+            '_IdLayout__set'
+            ]
+
+    # Private methods
+    #################
+
+    def __compute(self, count):
+        """
+        Return the layout of count ids as a tuple of extents (inside,
+        outside, count) where inside starts from 0, or None if the set does
+        not have count ids usable by the kernel.
+        """
+
+        firsts, counts = self.__set._merged_columns()
+        sizes = []
+        for first, size in zip(firsts, counts):
+            if first >= ID_LIMIT:
+                break
+            sizes.append((min(size, ID_LIMIT - first), first))
+
+        # The largest ranges give the fewest extents, the lowest one is
+        # taken among ranges of the same size
+        sizes.sort(key=lambda item: (-item[0], item[1]))
+        chosen = []
+        left = count
+        for size, first in sizes:
+            if not left:
+                break
+            chosen.append((first, min(size, left)))
+            left -= chosen[-1][1]
+        if left:
+            return None
+
+        chosen.sort()
+        layout = []
+        inside = 0
+        for outside, size in chosen:
+            layout.append((inside, outside, size))
+            inside += size
+
+        return tuple(layout)
+
+    # Public methods
+    ################
+
+    def extents(self, count, first=0, limit=None):
+        """
+        Return the list of the extents (inside, outside, count) mapping the
+        count consecutive ids of the namespace from the id first to ids of
+        the set. Raise ValueError if the set does not have enough ids or
+        if more than limit extents are needed.
+        """
+
+        if first + count > ID_LIMIT:
+            raise ValueError(
+                    "namespace ids cannot exceed {}".format(ID_LIMIT - 1)
+                    )
+
+        layout = self.__layouts.get(count)
+        if layout is None:
+            layout = self.__compute(count)
+            if layout is None:
+                raise ValueError(
+                        "not enough ids to map {} ids".format(count)
+                        )
+            self.__layouts[count] = layout
+
+        if limit is not None and len(layout) > limit:
+            raise ValueError(
+                    "{} ids need {} extents, more than {}".format(
+                        count,
+                        len(layout),
+                        limit
+                        )
+                    )
+
+        return [
+                (first + inside, outside, size)
+                for inside, outside, size in layout
+                ]
+
+    def invalidate(self):
+        """
+        Forget the cached layouts. This method is called by the watched
+        IdRangeSet object each time it changes.
+        """
+
+        self.__layouts.clear()
+
+    def release(self):
+        """Stop watching the id range set."""
+
+        self.__set._discard_watcher(self)
+        self.__layouts.clear()
+
+    # Properties
+    ############
+
+    id_range_set = property(
+            lambda self: self.__set,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'id_range_set'"
+            )
+
+def format_map(extents):
+    """
+    Return the extents (inside, outside, count) as the lines to write in
+    '/proc/<pid>/uid_map' or '/proc/<pid>/gid_map'.
+    """
+
+    return ''.join(
+            '{} {} {}\n'.format(inside, outside, count)
+            for inside, outside, count in extents
+            )
+
+def newidmap_args(extents):
+    """
+    Return the extents (inside, outside, count) as the list of arguments
+    of newuidmap or newgidmap following the process id.
+    """
+
+    args = []
+    for extent in extents:
+        args.extend(str(value) for value in extent)
+
+    return args
@@ -17,8 +17,31 @@
 
 """IdMap class definition and its derivatives."""
 
+import gc
+import mmap
+import os
+import stat
+import sys
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from heapq import heappop, heappush, merge
+from itertools import accumulate, chain, islice
+
+from subordinate.idfreespace import IdFreeSpace
+from subordinate.idindex import IdIndex
+from subordinate.idlayout import IdLayout
+from subordinate.idnames import IdNames
+from subordinate.idparser import (
+        BLOCK_SIZE, decode_names, parse_block, parse_buffer, parse_file,
+        parse_parallel
+        )
+from subordinate.idrange import IdRange
 from subordinate.idrangeset import IdRangeSet
-from subordinate.utils import BadIdFile, Config
+from subordinate.idsource import IdSource
+from subordinate.utils import (
+        BadIdFile, Config, subordinate_no_del, subordinate_no_set
+        )
 
 class IdMap(object):
     """
@@ -32,13 +55,25 @@ class IdMap(object):
     # Constructor
     #############
 
-    def __init__(self):
+    def __init__(self, normalized=False, resolver=None):
         """
         Constructor method.
-        On create, the map is empty.
+        On create, the map is empty. If normalized is True, the id range
+        sets of the map are normalized (see IdRangeSet). If resolver is an
+        IdNames object, the names are stored and looked up under their
+        canonical form (see IdNames.canonical): the lines of a numeric id
+        known to the system are read, and written back, under its name.
         """
 
+        self.__index = IdIndex()
+        self.__layouts = {}
         self.__map = {}
+        self.__normalized = bool(normalized)
+        self.__origin_files = []
+        self.__origins = {}
+        self.__pending = None
+        self.__resolver = resolver
+        self.__source = None
 
     # Special methods
     #################
@@ -46,17 +81,17 @@ class IdMap(object):
     def __contains__(self, name):
         """Return name in self."""
 
-        return name in self.__map
+        return self.__key(name) in self.__map
 
     def __getitem__(self, name):
         """Return self[name]."""
 
-        return self.__map[name]
+        return self.__map[self.__key(name)]
 
     def __len__(self):
         """Return len(self)."""
 
-        return len(self.__map)
+        return len(self.__loaded())
 
     def __str__(self):
         """Return str(self)."""
@@ -66,13 +101,139 @@ class IdMap(object):
     # Miscellaneous
     ###############
 
-    __slots__ = ['_IdMap__map']
+    __slots__ = [
+            '_IdMap__index',
+            '_IdMap__layouts',
+            '_IdMap__map',
+            '_IdMap__normalized',
+            '_IdMap__origin_files',
+            '_IdMap__origins',
+            '_IdMap__pending',
+            '_IdMap__resolver',
+            '_IdMap__source'
+            ]
 
-    # Public methods
-    ################
+    # Private methods
+    #################
 
-    def append(self, name):
-        """If name is not in the map, append it with an empty id range set."""
+    def __attach(self, name):
+        """
+        Associate an empty id range set watched by the index of the map
+        to name and return it.
+        """
+
+        id_range_set = IdRangeSet(self.__normalized)
+        id_range_set._add_watcher(self.__index)
+        self.__map[name] = id_range_set
+
+        return id_range_set
+
+    def __lines(self):
+        """Generate the lines of the id map, ended by newlines."""
+
+        for name, id_range_set in self.__loaded().items():
+            prefix = name + ':'
+            for first, count in zip(*id_range_set._columns()):
+                yield prefix + str(first) + ':' + str(count) + '\n'
+
+    def __load(self, names, firsts, counts):
+        """
+        Append to the map the ranges given by the parallel sequences names,
+        firsts and counts coming from a parsed id file, where names is a
+        list of blocks of names as bytes joined by newlines. Return the
+        list of the names of the ranges.
+        """
+
+        names = self.__canonical(decode_names(names))
+
+        # Millions of new objects may be created, do not let the garbage
+        # collector walk through them again and again
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # Gather the lines of each name, in the order of the file, so
+            # that its ranges are slices of the columns
+            rank = dict.fromkeys(names)
+            if len(rank) < len(names):
+                for i, name in enumerate(rank):
+                    rank[name] = i
+                keys = list(map(rank.__getitem__, names))
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                firsts = array('Q', map(firsts.__getitem__, order))
+                counts = array('Q', map(counts.__getitem__, order))
+                ends = list(accumulate(Counter(keys).values()))
+            else:
+                ends = range(1, len(names) + 1)
+            slices = [
+                    (name, firsts[start:end], counts[start:end])
+                    for name, start, end in zip(rank, chain((0,), ends), ends)
+                    ]
+
+            # Give its ranges to each name at once
+            get = self.__map.get
+            for name, name_firsts, name_counts in slices:
+                id_range_set = get(name)
+                if id_range_set is None:
+                    if self.__normalized and len(name_firsts) > 1:
+                        # The ranges of a normalized set are sorted and
+                        # merged, those of the file may not be
+                        name_firsts, name_counts = IdRangeSet._from_columns(
+                                name_firsts,
+                                name_counts
+                                )._merged_columns()
+                    self.__map[name] = IdRangeSet._from_columns(
+                            name_firsts, name_counts,
+                            self.__normalized,
+                            self.__index
+                            )
+                else:
+                    id_range_set._extend(name_firsts, name_counts)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.__index.invalidate()
+
+        return names
+
+    def __canonical(self, names):
+        """
+        Return the list of the keys of the list of names in the map, their
+        canonical forms resolved at once if the map has a resolver.
+        """
+
+        if self.__resolver is None:
+            return names
+
+        return self.__resolver.canonical_many(names)
+
+    @staticmethod
+    def __check_count(count):
+        """
+        Check that count is a valid number of ids to allocate and return
+        it, or Config.sub_id_count if count is None.
+        """
+
+        if count is None:
+            return Config.sub_id_count
+
+        if not isinstance(count, int):
+            raise TypeError(
+                    "argument 'count' must be an integer, not {}".format(
+                        count.__class__.__name__
+                        )
+                    )
+
+        if count < 1:
+            raise ValueError(
+                    "argument 'count' must be a positive integer: "
+                    "{}".format(count)
+                    )
+
+        return count
+
+    @staticmethod
+    def __check_name(name):
+        """Check that name is a valid name for the map and return it."""
 
         if not isinstance(name, str):
             raise TypeError(
@@ -84,13 +245,476 @@ class IdMap(object):
         if not name:
             raise ValueError("argument 'name' cannot be empty")
 
+        return name
+
+    @staticmethod
+    def __check_policy(policy):
+        """Check that policy is a known allocation policy."""
+
+        if policy not in IdFreeSpace.POLICIES:
+            raise ValueError(
+                    "argument 'policy' must be one of {}, not {!r}".format(
+                        ', '.join(IdFreeSpace.POLICIES),
+                        policy
+                        )
+                    )
+
+    def __fetched(self, name):
+        """
+        Return the dictionary of the map once the lines of name in the
+        pending id file, if any, are appended to it. Only these lines are
+        parsed, they are found by searching the name, and its numeric id
+        if the map has a resolver, in the raw content of the file which is
+        kept until the whole file is read.
+        """
+
+        if self.__pending is None:
+            return self.__map
+        id_filename, options, snapshot, fetched = self.__pending
+        if name in fetched or not isinstance(name, str):
+            return self.__map
+        if ':' in name or '\n' in name:
+            # Not a name of the file, it would match other lines
+            return self.__map
+
+        if snapshot is None:
+            with open(id_filename, 'rb') as id_file:
+                snapshot = os.fstat(id_file.fileno()), id_file.read()
+            self.__pending = id_filename, options, snapshot, fetched
+        data = snapshot[1]
+
+        keys = [name]
+        if self.__resolver is not None:
+            alias = self.__resolver.alias(name)
+            if alias is not None and self.__resolver.canonical(alias) == name:
+                keys.append(alias)
+
+        # The lines of name start the file or follow a newline
+        starts = []
+        for key in keys:
+            key = key.encode(sys.getfilesystemencoding(), 'surrogateescape')
+            pattern = b'\n' + key + b':'
+            if data.startswith(pattern[1:]):
+                starts.append(0)
+            newline = data.find(pattern)
+            while newline >= 0:
+                starts.append(newline + 1)
+                newline = data.find(pattern, newline + 1)
+        starts.sort()
+
+        firsts = array('Q')
+        counts = array('Q')
+        lineno = 0
+        previous = 0
+        for start in starts:
+            lineno += data.count(b'\n', previous, start)
+            end = data.find(b'\n', start) + 1 or len(data)
+            _, line_firsts, line_counts = parse_block(
+                    data[start:end],
+                    id_filename,
+                    lineno
+                    )
+            firsts.extend(line_firsts)
+            counts.extend(line_counts)
+            previous = start
+
+        if firsts:
+            id_range_set = self.__map.get(name)
+            if id_range_set is None:
+                id_range_set = self.__attach(name)
+            id_range_set._extend(firsts, counts)
+        fetched.add(name)
+
+        return self.__map
+
+    def __key(self, name):
+        """
+        Return the key of name in the map, which is its canonical form if
+        the map has a resolver, else name itself. The lines of the key in
+        the pending id file, if any, are fetched.
+        """
+
+        if self.__resolver is not None and isinstance(name, str):
+            name = self.__resolver.canonical(name)
+        self.__fetched(name)
+
+        return name
+
+    def __loaded(self):
+        """
+        Return the dictionary of the map once the pending id file, if any,
+        is read. The id range sets of the names already fetched from this
+        file are kept as they are.
+        """
+
+        if self.__pending is None:
+            return self.__map
+        id_filename, options, snapshot, fetched = self.__pending
+        if snapshot is None:
+            self.__pending = None
+            self.read(id_filename, *options)
+            return self.__map
+
+        # The whole file is parsed from the content the fetched names come
+        # from, their lines must not be appended twice
+        id_stat, data = snapshot
+        parsed = parse_buffer(data, id_filename)
+        kept = {}
+        for name in fetched:
+            if name in self.__map:
+                kept[name] = self.__map.pop(name)
+        names = self.__load(*parsed)
+        self.__map.update(kept)
+        self.__pending = None
+        self.__source = IdSource(
+                id_filename, id_stat, names,
+                self.__canonical
+                )
+
+        return self.__map
+
+    def __indexed(self):
+        """Return the index of the map, rebuilt if it is out of date."""
+
+        self.__loaded()
+        if not self.__index.valid:
+            self.__index.rebuild(self.__map)
+
+        return self.__index
+
+    # Public methods
+    ################
+
+    def allocate(self, name, count=None, id_min=None, id_max=None,
+            policy='first'):
+        """
+        Give to name, which is appended to the map if needed, a range of
+        count consecutive ids owned by nobody between the ids id_min and
+        id_max. The range is chosen according to policy, one of 'first',
+        'best' or 'next' (see IdFreeSpace). The defaults are taken from
+        Config. Return the new IdRange or raise ValueError if there is no
+        room for it.
+        """
+
+        self.__loaded()
+        count = self.__check_count(count)
+        self.__check_policy(policy)
+        if id_min is None:
+            id_min = Config.sub_id_min
+        if id_max is None:
+            id_max = Config.sub_id_max
+
+        name = self.__key(self.__check_name(name))
+        new_name = name not in self.__map
+        self.append(name)
+        index = self.__indexed()
+        first = index.allocate(name, count, id_min, id_max, policy)
+        if first is None:
+            if new_name:
+                self.remove(name)
+            raise ValueError(
+                    "no range of {} free ids between {} and {}".format(
+                        count, id_min, id_max
+                        )
+                    )
+
+        # The index already knows the new range
+        id_range_set = self.__map[name]
+        id_range_set._discard_watcher(index)
+        try:
+            id_range_set.append(first, count)
+        finally:
+            id_range_set._add_watcher(index)
+
+        return IdRange(first, count)
+
+    def allocate_many(self, requests, id_min=None, id_max=None,
+            policy='first'):
+        """
+        Give ranges of free ids between id_min and id_max to several names
+        at once. The argument requests is an iterable of tuples (name,
+        count) where count may be None for the default size. All the
+        ranges are placed in one pass over the free extents of the map
+        according to policy, then inserted in the map together. Return
+        the list of the new IdRange objects in the order of requests or
+        raise ValueError, leaving the map unchanged, if they do not fit.
+        """
+
+        self.__loaded()
+        self.__check_policy(policy)
+        if id_min is None:
+            id_min = Config.sub_id_min
+        if id_max is None:
+            id_max = Config.sub_id_max
+
+        requests = [
+                (self.__check_name(name), self.__check_count(count))
+                for name, count in requests
+                ]
+        requests = list(zip(
+                self.__canonical([name for name, _ in requests]),
+                [count for _, count in requests]
+                ))
+
+        # Place the ranges
+        free = IdFreeSpace(
+                self.__indexed().gaps(id_min, id_max),
+                id_min, id_max
+                )
+        firsts = []
+        for name, count in requests:
+            first = free.allocate(count, policy)
+            if first is None:
+                raise ValueError(
+                        "no range of {} free ids between {} and {} "
+                        "for {!r}".format(count, id_min, id_max, name)
+                        )
+            firsts.append(first)
+
+        # Insert them by name
+        groups = {}
+        for (name, count), first in zip(requests, firsts):
+            columns = groups.get(name)
+            if columns is None:
+                columns = groups[name] = (array('Q'), array('Q'))
+            columns[0].append(first)
+            columns[1].append(count)
+        for name, (group_firsts, group_counts) in groups.items():
+            id_range_set = self.__map.get(name)
+            if id_range_set is None:
+                id_range_set = self.__attach(name)
+            id_range_set._extend(group_firsts, group_counts)
+
+        return [
+                IdRange(first, count)
+                for (_, count), first in zip(requests, firsts)
+                ]
+
+    def append(self, name):
+        """If name is not in the map, append it with an empty id range set."""
+
+        self.__loaded()
+        name = self.__key(self.__check_name(name))
         if not name in self.__map:
-            self.__map[name] = IdRangeSet()
+            self.__attach(name)
+
+    def apply(self, diff):
+        """
+        Patch the map with diff, as returned by the method diff of the map
+        or of a map with the same content, so that the names of the map
+        and their ids become those of the map diff was computed against.
+        The ranges of the unchanged names are left untouched.
+        """
+
+        self.__loaded()
+        for name, change in diff.items():
+            if change is None:
+                if name in self.__map:
+                    self.remove(name)
+                continue
+
+            added, removed = change
+            self.append(name)
+            id_range_set = self.__map[name]
+            id_range_set.remove_many(removed)
+            for id_range in added:
+                id_range_set.append(id_range.first, id_range.count)
 
     def clear(self):
-        """Remove all names and id range sets from the map."""
+        """
+        Remove all names and id range sets from the map. An id file still
+        pending is not read.
+        """
 
+        self.__pending = None
+        for id_range_set in self.__map.values():
+            id_range_set._discard_watcher(self.__index)
+        for layout in self.__layouts.values():
+            layout.release()
+        self.__layouts.clear()
         self.__map.clear()
+        self.__origin_files = []
+        self.__origins.clear()
+        self.__index.invalidate()
+        self.__source = None
+
+    def compaction_plan(self, id_min=None, id_max=None):
+        """
+        Plan the relocation of the ids of the map giving to each name a
+        single block of consecutive ids, as many as it owns, which does
+        not overlap the block of another name. Return the list of the
+        moves as tuples (name, old_first, new_first, count), meaning that
+        the count ids of name from old_first become the ids from
+        new_first, in the order of the map then of the old ids. The ids
+        which stay in place are not listed.
+
+        A name may keep its block in place around its largest range, the
+        blocks kept being chosen not to overlap and to move as few ids as
+        possible. The other names get blocks in the free space between
+        id_min and id_max, the largest first. The defaults are taken from
+        Config. Raise ValueError if the blocks do not fit. The ranges are
+        sorted once, the other blocks are placed by best fit (see
+        IdFreeSpace) and the map is not changed.
+        """
+
+        self.__loaded()
+        if id_min is None:
+            id_min = Config.sub_id_min
+        if id_max is None:
+            id_max = Config.sub_id_max
+
+        names = list(self.__map)
+        columns = [
+                id_range_set._merged_columns()
+                for id_range_set in self.__map.values()
+                ]
+
+        # Each name may stay around its largest range, the other ranges
+        # being moved next to it in order
+        candidates = []
+        totals = []
+        for rank, (firsts, counts) in enumerate(columns):
+            totals.append(sum(counts))
+            if not counts:
+                continue
+            k = max(range(len(counts)), key=counts.__getitem__)
+            first = firsts[k] - sum(counts[:k])
+            if len(counts) > 1 and (first < id_min
+                    or first + totals[rank] - 1 > id_max):
+                continue
+            kept = 0
+            new_first = first
+            for old_first, count in zip(firsts, counts):
+                if old_first == new_first:
+                    kept += count
+                new_first += count
+            candidates.append((new_first, first, kept, rank))
+
+        # Keep the candidates which do not overlap and move as few ids as
+        # possible, best[i] is the number of ids kept among the i first
+        # ones by end
+        candidates.sort()
+        ends = [end for end, _, _, _ in candidates]
+        best = [0]
+        for end, first, kept, _ in candidates:
+            j = bisect_right(ends, first)
+            best.append(max(best[-1], best[j] + kept))
+
+        blocks = {}
+        starts = []
+        stops = []
+        i = len(candidates)
+        while i:
+            end, first, kept, rank = candidates[i-1]
+            j = bisect_right(ends, first)
+            if best[j] + kept >= best[i-1]:
+                blocks[rank] = first
+                starts.append(first)
+                stops.append(end)
+                i = j
+            else:
+                i -= 1
+        starts.reverse()
+        stops.reverse()
+
+        # Place the other blocks in the free space, largest first
+        pending = sorted(
+                (-total, rank) for rank, total in enumerate(totals)
+                if total and rank not in blocks
+                )
+        gaps = []
+        previous = id_min
+        for start, stop in zip(starts, stops):
+            if previous < start:
+                gaps.append((previous, start - previous))
+            previous = max(previous, stop)
+        if previous <= id_max:
+            gaps.append((previous, id_max - previous + 1))
+        free = IdFreeSpace(gaps, id_min, id_max)
+        for total, rank in pending:
+            first = free.allocate(-total, 'best')
+            if first is None:
+                raise ValueError(
+                        "no range of {} free ids between {} and {} "
+                        "for {!r}".format(-total, id_min, id_max, names[rank])
+                        )
+            blocks[rank] = first
+
+        # List the moves
+        plan = []
+        for rank, (firsts, counts) in enumerate(columns):
+            new_first = blocks.get(rank)
+            for first, count in zip(firsts, counts):
+                if first != new_first:
+                    plan.append((names[rank], first, new_first, count))
+                new_first += count
+
+        return plan
+
+    def conflicts(self):
+        """
+        Return the list of the overlaps between the id range sets of two
+        different names. Each overlap is a tuple (name_a, name_b, id_range)
+        where id_range is an IdRange of ids owned by both names, as large
+        as possible. The overlaps are sorted by their first id and found
+        by a single sweep over the sorted ranges of the map.
+        """
+
+        self.__loaded()
+        names = list(self.__map)
+        ranges = []
+        for rank, id_range_set in enumerate(self.__map.values()):
+            for first, count in zip(*id_range_set._merged_columns()):
+                ranges.append((first, first + count, rank))
+        ranges.sort()
+
+        answer = []
+        active = []
+        for start, end, rank in ranges:
+            # Ranges ended before start cannot overlap anymore
+            while active and active[0][0] <= start:
+                heappop(active)
+
+            for other_end, other in active:
+                answer.append((
+                    names[other],
+                    names[rank],
+                    IdRange(start, min(end, other_end) - start)
+                    ))
+            heappush(active, (end, rank))
+
+        return answer
+
+    def diff(self, other):
+        """
+        Return the changes turning the map into the IdMap object other as a
+        dictionary mapping each name whose ids differ to None if the name
+        is not in other, else to a tuple (added, removed) of the sorted
+        lists of the IdRange objects to add to it and to remove from it.
+        The ranges of a name are first compared as arrays, so that names
+        left unchanged cost little, and the others are compared by linear
+        merges of their sorted ranges.
+        """
+
+        self.__loaded()
+        other_map = other.__loaded()
+
+        changes = {}
+        empty = IdRangeSet()
+        for name, other_set in other_map.items():
+            id_range_set = self.__map.get(name)
+            if id_range_set is None:
+                changes[name] = (list(other_set - empty), [])
+            elif id_range_set._columns() != other_set._columns():
+                added = other_set - id_range_set
+                removed = id_range_set - other_set
+                if len(added) or len(removed):
+                    changes[name] = (list(added), list(removed))
+        for name in self.__map:
+            if name not in other_map:
+                changes[name] = None
+
+        return changes
 
     def get(self, name, default=None):
         """
@@ -98,20 +722,132 @@ class IdMap(object):
         else default.
         """
 
-        return self.__map.get(name, default)
+        return self.__map.get(self.__key(name), default)
 
     def names(self):
         """Return a list containing the names in the map."""
 
-        return list(self.__map.keys())
+        return list(self.__loaded().keys())
+
+    def namespace_map(self, name, count=None, first=0, limit=None):
+        """
+        Return the extents mapping count consecutive ids of a user
+        namespace, from the id first, to the ids of name as a list of
+        tuples (namespace id, id of name, count), ready to be formatted
+        by the functions of subordinate.idlayout. The largest ranges of
+        name are used first so that the extents are as few as possible,
+        and the layout is cached per name and count until the ranges of
+        name change (see IdLayout). The defaults of count and limit, the
+        maximal number of extents, are taken from Config. Raise KeyError
+        if name is not in the map and ValueError if name does not have
+        enough ids or if the extents would be more than limit.
+        """
+
+        count = self.__check_count(count)
+        if limit is None:
+            limit = Config.max_map_extents
+
+        name = self.__key(name)
+        id_range_set = self.__map[name]
+        layout = self.__layouts.get(name)
+        if layout is None or layout.id_range_set is not id_range_set:
+            if layout is not None:
+                layout.release()
+            layout = self.__layouts[name] = IdLayout(id_range_set)
+
+        return layout.extents(count, first, limit)
+
+    def origins(self, name):
+        """
+        Return the list of the tuples (IdRange, id_filename) of the lines
+        of name read by read_many, sorted by first id, where id_filename
+        is the file of the line. The list does not follow the changes
+        made to the map since then. Return an empty list if no line of
+        name was read by read_many.
+        """
+
+        origin = self.__origins.get(self.__key(name))
+        if origin is None:
+            return []
 
-    def read(self, id_filename):
+        return [
+                (IdRange(first, count), self.__origin_files[rank])
+                for first, count, rank in zip(*origin)
+                ]
+
+    def read(self, id_filename, use_mmap=None, cache_dir=None, lazy=False,
+            workers=None):
         """
-        Attempt to read and parse the file named id_filename.
+        Attempt to read and parse the file named id_filename. The file is
+        read as bytes by large blocks whose lines are converted in bulk and
+        the map is only changed once the whole file is parsed. If use_mmap
+        is True, the file is parsed straight from a read only memory map
+        of it instead of being read. The default is Config.use_mmap.
+
+        If cache_dir is a directory, the parsed file is loaded from a
+        binary cache stored there when it is fresh and the cache is
+        updated otherwise (see IdCache). The default is Config.cache_dir
+        and an empty string disables the cache.
+
+        If lazy is True, the file is only read when the map is first used.
+        Looking up a name with in, [] or get parses the lines of this name
+        alone, any other use parses the whole file.
+
+        If workers is greater than 1, a file larger than a block is cut
+        into chunks parsed by this number of processes (see
+        subordinate.idparser.parse_parallel). The default is
+        Config.parse_workers.
         """
 
-        with open(id_filename, 'rt') as id_file:
-            self.read_file(id_file)
+        if use_mmap is None:
+            use_mmap = Config.use_mmap
+        if cache_dir is None:
+            cache_dir = Config.cache_dir
+        if workers is None:
+            workers = Config.parse_workers
+
+        # A file still pending is read first to keep the order of the lines
+        self.__loaded()
+        if lazy:
+            self.__pending = (
+                    id_filename,
+                    (use_mmap, cache_dir, False, workers),
+                    None,
+                    set()
+                    )
+            return
+
+        # The cache is seldom used, do not import it with the module
+        if cache_dir:
+            from subordinate.idcache import IdCache
+            cache = IdCache(cache_dir)
+        else:
+            cache = None
+
+        with open(id_filename, 'rb') as id_file:
+            id_stat = os.fstat(id_file.fileno())
+            parsed = cache.load(id_filename, id_stat) if cache else None
+
+            if parsed is None:
+                if workers > 1 and id_stat.st_size > BLOCK_SIZE:
+                    parsed = parse_parallel(id_file, id_filename, workers)
+                elif not use_mmap or id_stat.st_size == 0:
+                    parsed = parse_file(id_file, id_filename)
+                else:
+                    with mmap.mmap(
+                            id_file.fileno(), 0,
+                            access=mmap.ACCESS_READ
+                            ) as id_buffer:
+                        parsed = parse_buffer(id_buffer, id_filename)
+
+                if cache:
+                    cache.save(id_filename, id_stat, parsed)
+
+        names = self.__load(*parsed)
+        self.__source = IdSource(
+                id_filename, id_stat, names,
+                self.__canonical
+                )
 
     def read_file(self, id_file):
         """
@@ -120,6 +856,7 @@ class IdMap(object):
         '/etc/subgid'.
         """
 
+        self.__loaded()
         lineno = 0
         for line in id_file:
             lineno += 1
@@ -131,7 +868,7 @@ class IdMap(object):
                         'incorrect number of fields'
                         )
 
-            name = id_data[0]
+            name = self.__canonical([id_data[0]])[0]
             try:
                 first, count = int(id_data[1]), int(id_data[2])
             except ValueError:
@@ -142,8 +879,129 @@ class IdMap(object):
 
             # Append the new range
             if not name in self.__map:
-                self.__map[name] = IdRangeSet()
-            self.__map[name].append(first, count)
+                self.__attach(name)
+            try:
+                self.__map[name].append(first, count)
+            except ValueError:
+                raise BadIdFile(
+                        id_file.name, lineno,
+                        'invalid id range'
+                        )
+
+    def read_many(self, sources):
+        """
+        Read and parse as a whole the id files and the directories of id
+        files given by sources, an iterable of paths. The files of a
+        directory are taken in the order of their names, except the hidden
+        and the backup ones. The lines of each file are sorted by name and
+        first id, then the files are merged in a single pass so that the
+        ranges of each name are appended to the map sorted and merged, as
+        simplify would do. The file of each line is recorded (see origins).
+        The map is only changed once all the files are parsed.
+        """
+
+        self.__loaded()
+
+        id_filenames = []
+        for source in sources:
+            if not os.path.isdir(source):
+                id_filenames.append(source)
+                continue
+            for entry in sorted(os.listdir(source)):
+                id_filename = os.path.join(source, entry)
+                if (not entry.startswith('.') and not entry.endswith('~')
+                        and os.path.isfile(id_filename)):
+                    id_filenames.append(id_filename)
+
+        rank = len(self.__origin_files)
+        streams = []
+        for id_filename in id_filenames:
+            with open(id_filename, 'rb') as id_file:
+                names, firsts, counts = parse_file(id_file, id_filename)
+            names = self.__canonical(decode_names(names))
+            streams.append(sorted(zip(
+                    names, firsts, counts,
+                    [rank] * len(names)
+                    )))
+            rank += 1
+
+        # Merge the sorted lines of the files, the ranges of a name come in
+        # a row and are merged as they come
+        ranges = {}
+        origins = {}
+        name = None
+        for line in merge(*streams):
+            if line[0] != name:
+                name = line[0]
+                new_first, new_count = ranges[name] = array('Q'), array('Q')
+                origin = origins[name] = (array('Q'), array('Q'), array('I'))
+            first, count = line[1], line[2]
+            if new_first and first <= new_first[-1] + new_count[-1]:
+                # Overlapping or consecutive ranges
+                new_count[-1] = max(
+                        new_count[-1],
+                        first + count - new_first[-1]
+                        )
+            else:
+                new_first.append(first)
+                new_count.append(count)
+            for column, value in zip(origin, line[1:]):
+                column.append(value)
+
+        for name, (new_first, new_count) in ranges.items():
+            id_range_set = self.__map.get(name)
+            if id_range_set is None:
+                self.__map[name] = IdRangeSet._from_columns(
+                        new_first, new_count,
+                        self.__normalized,
+                        self.__index
+                        )
+            else:
+                id_range_set._extend(new_first, new_count)
+        self.__index.invalidate()
+
+        self.__origin_files.extend(id_filenames)
+        for name, origin in origins.items():
+            old_origin = self.__origins.get(name)
+            if old_origin is None:
+                self.__origins[name] = origin
+            else:
+                for column, values in zip(old_origin, origin):
+                    column.extend(values)
+
+    def reload(self):
+        """
+        Read again the id file last read by the method read if it changed
+        since then, and update the id range sets of the names whose lines
+        changed in the file. The other id range sets, and the index of the
+        map if no set changed, are left untouched. Return the sorted list
+        of the updated names. Raise ValueError if the map was not read
+        from a file.
+        """
+
+        self.__loaded()
+        if self.__source is None:
+            raise ValueError("map was not read from an id file")
+
+        changes = self.__source.refresh()
+        if changes is None:
+            return []
+        ranges, gone = changes
+
+        updated = []
+        for name, (firsts, counts) in ranges.items():
+            id_range_set = self.__map.get(name)
+            if id_range_set is None:
+                self.__attach(name)._extend(firsts, counts)
+                updated.append(name)
+            elif id_range_set._assign(firsts, counts):
+                updated.append(name)
+        for name in gone:
+            if name in self.__map:
+                self.remove(name)
+                updated.append(name)
+
+        return sorted(updated)
 
     def remove(self, name):
         """
@@ -151,7 +1009,139 @@ class IdMap(object):
         else raise KeyError.
         """
 
-        del self.__map[name]
+        self.__loaded()
+        name = self.__key(name)
+        id_range_set = self.__map.pop(name)
+        id_range_set._discard_watcher(self.__index)
+        self.__index.invalidate()
+        layout = self.__layouts.pop(name, None)
+        if layout is not None:
+            layout.release()
+        self.__origins.pop(name, None)
+
+    def remove_ranges(self, ranges):
+        """
+        Remove the ranges of ids given by ranges, an iterable of IdRange
+        objects, from the id range sets of all the names in the map.
+        """
+
+        self.__loaded()
+        removed = IdRangeSet()
+        for id_range in ranges:
+            removed.append(id_range.first, id_range.count)
+        removed = IdRangeSet._from_columns(
+                *removed._merged_columns(),
+                normalized=True
+                )
+
+        for id_range_set in self.__map.values():
+            id_range_set.remove_many(removed)
+
+    def stats(self, id_min=None, id_max=None):
+        """
+        Return a dictionary of statistics about the map, computed from its
+        reverse index in one sweep over the sorted bounds of the ranges:
+            names: number of names,
+            ranges: number of ranges,
+            ranges_per_name: mean number of ranges of a name,
+            max_ranges_per_name: largest number of ranges of a name,
+            allocated: number of ids owned by at least one name,
+            shared: number of ids owned by several names,
+            free: number of ids owned by nobody between id_min and id_max,
+            largest_free: size of the largest extent of free ids,
+            fragmentation: share of the free ids outside of this extent.
+        The defaults of id_min and id_max are taken from Config.
+        """
+
+        if id_min is None:
+            id_min = Config.sub_id_min
+        if id_max is None:
+            id_max = Config.sub_id_max
+
+        index = self.__indexed()
+        allocated, shared, free, largest = index.usage(id_min, id_max)
+        sizes = [len(id_range_set) for id_range_set in self.__map.values()]
+
+        return {
+                'names': len(sizes),
+                'ranges': sum(sizes),
+                'ranges_per_name': sum(sizes) / len(sizes) if sizes else 0.0,
+                'max_ranges_per_name': max(sizes, default=0),
+                'allocated': allocated,
+                'shared': shared,
+                'free': free,
+                'largest_free': largest,
+                'fragmentation': 1 - largest / free if free else 0.0
+                }
+
+    def write(self, id_filename):
+        """
+        Write the id map in the file named id_filename. The lines are
+        written in a temporary file of the same directory which is synced
+        and renamed to id_filename, so that the file is replaced at once
+        and never seen half written. The permissions of an existing file
+        are kept.
+        """
+
+        # Only needed to write, do not import it with the module
+        import tempfile
+
+        id_dir = os.path.dirname(os.path.abspath(id_filename))
+        fd, tmp_filename = tempfile.mkstemp(
+                prefix='.' + os.path.basename(id_filename) + '.',
+                dir=id_dir
+                )
+
+        try:
+            with os.fdopen(
+                    fd, 'w',
+                    encoding=sys.getfilesystemencoding(),
+                    errors='surrogateescape'
+                    ) as id_file:
+                self.write_file(id_file)
+                id_file.flush()
+                os.fsync(id_file.fileno())
+
+            try:
+                id_stat = os.stat(id_filename)
+            except FileNotFoundError:
+                os.chmod(tmp_filename, 0o644)
+            else:
+                os.chmod(tmp_filename, stat.S_IMODE(id_stat.st_mode))
+                try:
+                    os.chown(tmp_filename, id_stat.st_uid, id_stat.st_gid)
+                except PermissionError:
+                    pass
+
+            os.replace(tmp_filename, id_filename)
+        except BaseException:
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+            raise
+
+        # Make the rename durable
+        dir_fd = os.open(id_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def write_file(self, id_file, chunk_size=8192):
+        """
+        Write the id map in id_file, a text file object, formatted as in
+        '/etc/subuid' or '/etc/subgid'. The lines are generated on the fly
+        and written by chunks of chunk_size lines, so the memory used does
+        not depend on the size of the map.
+        """
+
+        lines = self.__lines()
+        while True:
+            chunk = ''.join(islice(lines, chunk_size))
+            if not chunk:
+                break
+            id_file.write(chunk)
 
     def write_string(self):
         """
@@ -159,30 +1149,53 @@ class IdMap(object):
         properly formatted to be written in '/etc/subuid' or '/etc/subgid'.
         """
 
-        map_as_str = []
-        for name, id_range_set in self.__map.items():
-            for id_range in id_range_set:
-                map_as_str.append(
-                        name + ':' +
-                        str(id_range.first) + ':' +
-                        str(id_range.count) + '\n'
-                    )
-
         # Remove trailing newline
-        if len(map_as_str) > 0:
-            map_as_str[-1] = map_as_str[-1][:-1]
-
-        return ''.join(map_as_str)
+        return ''.join(self.__lines())[:-1]
 
     def who_has(self, subid):
-        """Return a list of names who own subid in their id range set."""
+        """
+        Return a list of names who own subid in their id range set. The
+        answer comes from a reverse index of the map which is rebuilt on
+        demand after a change.
+        """
 
-        answer = []
-        for name in self.__map:
-            if subid in self.__map[name] and not name in answer:
-                answer.append(name)
+        return self.__indexed().who_has(subid)
 
-        return answer
+    def who_has_many(self, ids):
+        """
+        Return a list holding, for each id of the sequence ids, the tuple
+        of the names who own it. The ids are searched together in the
+        reverse index of the map, with NumPy if it is available.
+        """
+
+        return self.__indexed().who_has_many(ids)
+
+    def who_overlaps(self, first, count):
+        """
+        Return a list of the names who own at least one of the count
+        consecutive ids starting at id first, in the order of their first
+        owned id in this range. The answer comes from the reverse index of
+        the map, only the part of it overlapping the range is visited.
+        """
+
+        return self.__indexed().who_overlaps(first, count)
+
+    # Properties
+    ############
+
+    normalized = property(
+            lambda self: self.__normalized,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'normalized'"
+            )
+
+    resolver = property(
+            lambda self: self.__resolver,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'resolver'"
+            )
 
 class UserIdMap(IdMap):
     """
@@ -194,16 +1207,26 @@ class UserIdMap(IdMap):
     # Constructor
     #############
 
-    def __init__(self, id_filename=Config.user_sub_id_file):
+    def __init__(self, id_filename=Config.user_sub_id_file, normalized=False,
+            lazy=None, resolve=None):
         """
         Constructor method.
         Attempt to read and parse the file named id_filename. An empty
-        map is returned if id_filename is None.
+        map is returned if id_filename is None. If normalized is True, the
+        id range sets of the map are normalized (see IdRangeSet). If lazy
+        is True, the file is only read when the map is first used (see
+        IdMap.read). If resolve is True, the names are also looked up
+        under their numeric user id and conversely (see IdNames). The
+        defaults are Config.lazy_load and Config.resolve_names.
         """
 
-        super().__init__()
+        if resolve is None:
+            resolve = Config.resolve_names
+        super().__init__(normalized, IdNames('passwd') if resolve else None)
+        if lazy is None:
+            lazy = Config.lazy_load
         if id_filename:
-            self.read(id_filename)
+            self.read(id_filename, lazy=lazy)
 
     # Miscellaneous
     ###############
@@ -220,16 +1243,26 @@ class GroupIdMap(IdMap):
     # Constructor
     #############
 
-    def __init__(self, id_filename=Config.group_sub_id_file):
+    def __init__(self, id_filename=Config.group_sub_id_file, normalized=False,
+            lazy=None, resolve=None):
         """
         Constructor method.
         Attempt to read and parse the file named id_filename. An empty
-        map is returned if id_filename is None.
+        map is returned if id_filename is None. If normalized is True, the
+        id range sets of the map are normalized (see IdRangeSet). If lazy
+        is True, the file is only read when the map is first used (see
+        IdMap.read). If resolve is True, the names are also looked up
+        under their numeric group id and conversely (see IdNames). The
+        defaults are Config.lazy_load and Config.resolve_names.
         """
 
-        super().__init__()
+        if resolve is None:
+            resolve = Config.resolve_names
+        super().__init__(normalized, IdNames('group') if resolve else None)
+        if lazy is None:
+            lazy = Config.lazy_load
         if id_filename:
-            self.read(id_filename)
+            self.read(id_filename, lazy=lazy)
 
     # Miscellaneous
     ###############
@@ -0,0 +1,246 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdNames class definition."""
+
+import grp
+import pwd
+from collections import OrderedDict
+
+from subordinate.utils import Config, subordinate_no_del, subordinate_no_set
+
+class IdNames(object):
+    """
+    IdNames(database, size=None) -> IdNames object
+
+    Returns a resolver between the names and the numeric ids of the
+    entries of database, 'passwd' for the users or 'group' for the groups,
+    which may key the lines of an id file under both forms. The canonical
+    form of an entry is its name. The answers of the system, found or not,
+    are kept in a cache of size entries where the least recently used ones
+    are dropped first.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self, database, size=None):
+        """
+        Constructor method.
+        The default size of the cache is Config.name_cache_size.
+        """
+
+        if database not in self.DATABASES:
+            raise ValueError(
+                    "{}() argument 'database' must be one of {}, "
+                    "not {!r}".format(
+                        self.__class__.__name__,
+                        ', '.join(self.DATABASES),
+                        database
+                        )
+                    )
+
+        if size is None:
+            size = Config.name_cache_size
+        if not isinstance(size, int):
+            raise TypeError(
+                    "{}() argument 'size' must be an integer, "
+                    "not {}".format(
+                        self.__class__.__name__,
+                        size.__class__.__name__
+                        )
+                    )
+        if size < 1:
+            raise ValueError(
+                    "{}() argument 'size' must be a positive integer: "
+                    "{}".format(self.__class__.__name__, size)
+                    )
+
+        self.__cache = OrderedDict()
+        self.__database = database
+        self.__size = size
+
+    # Special methods
+    #################
+
+    def __len__(self):
+        """Return the number of cached answers."""
+
+        return len(self.__cache)
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}({!r})".format(self.__class__.__name__, self.__database)
+
+    # Miscellaneous
+    ###############
+
+    # Supported databases
+    DATABASES = ('passwd', 'group')
+
+    # From this number of keys to resolve at once, the whole database is
+    # read once instead of asking for the keys one by one
+    ENUMERATE_MIN = 64
+
+    __slots__ = [
+            '_IdNames__cache',
+            '_IdNames__database',
+            '_IdNames__size'
+            ]
+
+    # Private methods
+    #################
+
+    def __ask(self, key):
+        """
+        Return the alias of key given by the system, or None if there is
+        none.
+        """
+
+        numeric = self.__numeric(key)
+        try:
+            if self.__database == 'passwd':
+                if numeric:
+                    return pwd.getpwuid(int(key)).pw_name
+                return str(pwd.getpwnam(key).pw_uid)
+            else:
+                if numeric:
+                    return grp.getgrgid(int(key)).gr_name
+                return str(grp.getgrnam(key).gr_gid)
+        except (KeyError, OverflowError, ValueError):
+            return None
+
+    def __enumerate(self):
+        """Generate the tuples (name, id) of the entries of the database."""
+
+        if self.__database == 'passwd':
+            for entry in pwd.getpwall():
+                yield entry.pw_name, str(entry.pw_uid)
+        else:
+            for entry in grp.getgrall():
+                yield entry.gr_name, str(entry.gr_gid)
+
+    @staticmethod
+    def __numeric(key):
+        """Return True if key is a numeric id written as a string."""
+
+        return (isinstance(key, str) and key.isascii() and key.isdigit()
+                and str(int(key)) == key)
+
+    def __store(self, key, alias):
+        """Cache alias as the alias of key."""
+
+        self.__cache[key] = alias
+        self.__cache.move_to_end(key)
+        while len(self.__cache) > self.__size:
+            self.__cache.popitem(last=False)
+
+    # Public methods
+    ################
+
+    def alias(self, key):
+        """
+        Return the other form of key, a name or a numeric id as a string:
+        the numeric id of a name or the name of a numeric id. Return None
+        if key is unknown to the system.
+        """
+
+        if not isinstance(key, str):
+            return None
+
+        try:
+            alias = self.__cache[key]
+        except KeyError:
+            alias = self.__ask(key)
+        self.__store(key, alias)
+
+        return alias
+
+    def alias_many(self, keys):
+        """
+        Return the list of the aliases of keys (see alias). The keys missing
+        from the cache are asked to the system only once each, or found by
+        reading the whole database once if they are many.
+        """
+
+        keys = list(keys)
+        answers = {}
+        missing = set()
+        for key in keys:
+            if key in self.__cache:
+                answers[key] = self.__cache[key]
+            else:
+                missing.add(key)
+
+        if len(missing) >= self.ENUMERATE_MIN:
+            for name, number in self.__enumerate():
+                if name in missing and name not in answers:
+                    answers[name] = number
+                if number in missing and number not in answers:
+                    answers[number] = name
+            missing.difference_update(answers)
+        for key in missing:
+            answers[key] = self.__ask(key)
+
+        for key, alias in answers.items():
+            self.__store(key, alias)
+
+        return [answers[key] for key in keys]
+
+    def canonical(self, key):
+        """
+        Return the canonical form of key, a name or a numeric id as a
+        string: the name of a numeric id known to the system, else key
+        itself. Only the numeric ids are asked to the system.
+        """
+
+        if self.__numeric(key):
+            alias = self.alias(key)
+            if alias is not None:
+                return alias
+
+        return key
+
+    def canonical_many(self, keys):
+        """
+        Return the list of the canonical forms of keys (see canonical). The
+        numeric ids among keys are resolved at once by alias_many.
+        """
+
+        keys = list(keys)
+        numbers = [key for key in dict.fromkeys(keys) if self.__numeric(key)]
+        if not numbers:
+            return keys
+
+        names = dict(zip(numbers, self.alias_many(numbers)))
+        return [names.get(key) or key for key in keys]
+
+    def clear(self):
+        """Forget the cached answers."""
+
+        self.__cache.clear()
+
+    # Properties
+    ############
+
+    database = property(
+            lambda self: self.__database,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'database'"
+            )
@@ -0,0 +1,264 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk parsing of id files."""
+
+import os
+import sys
+from array import array
+
+from subordinate.utils import BadIdFile, subordinate_stat_key
+
+# Size of the blocks read from an id file
+BLOCK_SIZE = 1 << 22
+
+# Upper bound of the ids which can be stored in an IdRangeSet
+ID_LIMIT = 1 << 64
+
+def parse_block(data, id_filename, lineno=0):
+    """
+    Parse data, a bytes object holding complete lines of an id file whose
+    first line is the line lineno+1 of the file id_filename. Return a
+    tuple (names, firsts, counts) where names are the names of the lines,
+    as bytes, joined by newlines, and firsts and counts are
+    arrays of the ranges, or None if data is empty. Raise BadIdFile if a
+    line is not correctly formatted.
+    """
+
+    if not data:
+        return None, array('Q'), array('Q')
+    if data.endswith(b'\n'):
+        data = data[:-1]
+
+    # In the common case, every line has three fields and splitting the
+    # whole block at once gives the fields of the lines in a row. The
+    # newlines are kept at the start of the names to check that.
+    fields = data.replace(b'\n', b':\n').split(b':')
+    nlines = data.count(b'\n') + 1
+    names = b''.join(fields[0::3])
+
+    if len(fields) == 3 * nlines and names.count(b'\n') == nlines - 1:
+        try:
+            firsts = array('Q', map(int, fields[1::3]))
+            counts = array('Q', map(int, fields[2::3]))
+        except (OverflowError, ValueError):
+            pass
+        else:
+            if 0 not in counts and max(firsts) + max(counts) <= ID_LIMIT:
+                return names, firsts, counts
+
+    # Some line is wrong, parse the block line by line to locate it
+    return parse_lines(data, id_filename, lineno)
+
+def parse_lines(data, id_filename, lineno=0):
+    """
+    Parse data line by line with the same result as parse_block but
+    raise BadIdFile with the number of the first incorrect line.
+    """
+
+    names = []
+    firsts = array('Q')
+    counts = array('Q')
+    for line in data.split(b'\n'):
+        lineno += 1
+        id_data = line.split(b':')
+
+        if len(id_data) != 3:
+            raise BadIdFile(
+                    id_filename, lineno,
+                    'incorrect number of fields'
+                    )
+
+        try:
+            first, count = int(id_data[1]), int(id_data[2])
+        except ValueError:
+            raise BadIdFile(
+                    id_filename, lineno,
+                    'cannot get the id range'
+                    )
+
+        if first < 0 or count < 1 or first + count > ID_LIMIT:
+            raise BadIdFile(
+                    id_filename, lineno,
+                    'invalid id range'
+                    )
+
+        names.append(id_data[0])
+        firsts.append(first)
+        counts.append(count)
+
+    return b'\n'.join(names), firsts, counts
+
+def parse_file(id_file, id_filename, block_size=BLOCK_SIZE):
+    """
+    Read and parse id_file, a binary file object, by blocks of about
+    block_size bytes cut at line boundaries. Return a tuple (names,
+    firsts, counts) as parse_block does for the whole file, except that
+    names is a list of the names of the non-empty blocks.
+    """
+
+    names = []
+    firsts = array('Q')
+    counts = array('Q')
+    lineno = 0
+    pending = b''
+    while True:
+        chunk = id_file.read(block_size)
+        if chunk:
+            data = pending + chunk
+            cut = data.rfind(b'\n') + 1
+            data, pending = data[:cut], data[cut:]
+        else:
+            data, pending = pending, b''
+
+        if data:
+            block = parse_block(data, id_filename, lineno)
+            names.append(block[0])
+            firsts.extend(block[1])
+            counts.extend(block[2])
+            lineno += data.count(b'\n')
+        if not chunk:
+            break
+
+    return names, firsts, counts
+
+def parse_buffer(buffer, id_filename, block_size=BLOCK_SIZE):
+    """
+    Parse buffer, the content of the id file id_filename given as bytes or
+    as a memory map, by windows of about block_size bytes cut at line
+    boundaries. Only one window is copied out of buffer at a time. Return
+    a tuple (names, firsts, counts) as parse_file does.
+    """
+
+    names = []
+    firsts = array('Q')
+    counts = array('Q')
+    lineno = 0
+    pos = 0
+    size = len(buffer)
+    while pos < size:
+        end = pos + block_size
+        if end < size:
+            # Cut after the last newline of the window, or after the first
+            # one beyond it for a line longer than the window
+            cut = buffer.rfind(b'\n', pos, end) + 1
+            if cut <= pos:
+                cut = buffer.find(b'\n', end) + 1
+            end = cut if cut > 0 else size
+        else:
+            end = size
+
+        data = buffer[pos:end]
+        block = parse_block(data, id_filename, lineno)
+        names.append(block[0])
+        firsts.extend(block[1])
+        counts.extend(block[2])
+        lineno += data.count(b'\n')
+        pos = end
+
+    return names, firsts, counts
+
+def parse_chunk(id_filename, id_key, start, end):
+    """
+    Read and parse the bytes from start to end, complete lines, of the id
+    file id_filename whose status key is id_key (see subordinate_stat_key)
+    and return a tuple (names, firsts, counts) as parse_block does. The
+    line numbers of BadIdFile start from the line at start. This function
+    is run by the workers of parse_parallel.
+    """
+
+    with open(id_filename, 'rb') as id_file:
+        if subordinate_stat_key(os.fstat(id_file.fileno())) != id_key:
+            raise OSError(
+                    "id file {!r} changed while parsed".format(id_filename)
+                    )
+        id_file.seek(start)
+        data = id_file.read(end - start)
+
+    return parse_block(data, id_filename)
+
+def parse_parallel(id_file, id_filename, workers, block_size=BLOCK_SIZE):
+    """
+    Parse id_file, the binary file object of the id file id_filename, with
+    workers processes. The file is cut at line boundaries into chunks of
+    at least block_size bytes, each one read and parsed by a worker.
+    Return a tuple (names, firsts, counts) as parse_file does. The line
+    numbers of BadIdFile are those of the whole file.
+    """
+
+    # Starting processes is seldom needed, do not import it with the module
+    from concurrent.futures import ProcessPoolExecutor
+
+    id_stat = os.fstat(id_file.fileno())
+    size = id_stat.st_size
+    chunk_size = max(block_size, -(-size // (4 * workers)))
+
+    # Cut the chunks after the first newline from their expected end
+    bounds = [0]
+    while bounds[-1] < size:
+        pos = bounds[-1] + chunk_size - 1
+        if pos >= size - 1:
+            bounds.append(size)
+            continue
+        id_file.seek(pos)
+        while True:
+            piece = id_file.read(1 << 16)
+            cut = piece.find(b'\n')
+            if not piece or cut >= 0:
+                break
+            pos += len(piece)
+        bounds.append(pos + cut + 1 if piece else size)
+
+    names = []
+    firsts = array('Q')
+    counts = array('Q')
+    id_key = subordinate_stat_key(id_stat)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+                executor.submit(parse_chunk, id_filename, id_key, start, end)
+                for start, end in zip(bounds, bounds[1:])
+                ]
+        for future in futures:
+            try:
+                block = future.result()
+            except BadIdFile as error:
+                # Each line of the previous chunks gave one range
+                raise BadIdFile(
+                        id_filename,
+                        len(firsts) + error.lineno,
+                        error.message
+                        )
+            names.append(block[0])
+            firsts.extend(block[1])
+            counts.extend(block[2])
+
+    return names, firsts, counts
+
+def decode_names(names):
+    """
+    Decode names, a list of blocks of names as bytes joined by newlines,
+    with the file system encoding as os.fsdecode does and return the list
+    of the names as strings. The names are decoded together in one call.
+    """
+
+    if not names:
+        return []
+
+    return b'\n'.join(names).decode(
+            sys.getfilesystemencoding(),
+            'surrogateescape'
+            ).split('\n')
@@ -17,6 +17,8 @@
 
 """IdRange class definition."""
 
+from weakref import WeakValueDictionary
+
 from subordinate.utils import subordinate_no_del, subordinate_no_set
 
 class IdRange(object):
@@ -24,6 +26,8 @@ class IdRange(object):
     IdRange(first, count) -> IdRange object
 
     Returns a virtual sequence of count consecutive ids starting at start.
+    An IdRange object is an immutable value, equal ranges have the same
+    hash and can be shared (see intern).
     """
 
     # Constructor
@@ -79,6 +83,11 @@ class IdRange(object):
         else:
             return False
 
+    def __hash__(self):
+        """Return hash(self)."""
+
+        return hash((self.__first, self.__count))
+
     def __str__(self):
         """Return str(self)."""
 
@@ -178,13 +187,33 @@ class IdRange(object):
     # Miscellaneous
     ###############
 
-    __hash__ = object.__hash__
+    # Interned ranges, kept as long as they are used
+    __interned = WeakValueDictionary()
 
     __slots__ = [
             '_IdRange__count',
-            '_IdRange__first'
+            '_IdRange__first',
+            '__weakref__'
             ]
 
+    # Public methods
+    ################
+
+    @classmethod
+    def intern(cls, first, count):
+        """
+        Return an IdRange object of count consecutive ids starting at first
+        which is shared by all the callers asking for the same range, so
+        that equal ranges are the same object while it is in use.
+        """
+
+        key = (cls, first, count)
+        id_range = IdRange.__interned.get(key)
+        if id_range is None:
+            id_range = IdRange.__interned[key] = cls(first, count)
+
+        return id_range
+
     # Properties
     ############
 
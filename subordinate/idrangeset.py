@@ -17,37 +17,63 @@
 
 """IdRangeSet class definition."""
 
+from array import array
+from bisect import bisect_left, bisect_right
+
 from subordinate.idrange import IdRange
+from subordinate.utils import (
+        Config, subordinate_id_array, subordinate_int, subordinate_no_del,
+        subordinate_no_set, subordinate_numpy
+        )
 
 class IdRangeSet(object):
     """
-    IdRangeSet() -> IdRangeSet object
+    IdRangeSet(normalized=False) -> IdRangeSet object
 
     Returns an empty set of ranges of consecutive ids. Such a set can
     contain IdRange object which are not necessarily unique and which
-    can overlap themselves.
+    can overlap themselves. A normalized set keeps its ranges sorted and
+    disjoint, as after a call to simplify, on every change.
+
+    The ranges are stored in two packed arrays of unsigned 64-bit integers
+    holding their first ids and their counts. IdRange objects are only
+    created when the ranges are accessed.
     """
 
     # Constructor
     #############
 
-    def __init__(self):
+    def __init__(self, normalized=False):
         """
         Constructor method.
-        On create, the set is empty.
+        On create, the set is empty. If normalized is True, the ranges are
+        kept sorted and disjoint so that membership tests and changes are
+        done by binary search.
         """
 
-        self.__range = []
+        self.__count = array('Q')
+        self.__first = array('Q')
+        self.__normalized = bool(normalized)
+        self.__sorted = None
+        self.__watchers = []
 
     # Special methods
     #################
 
+    def __and__(self, other):
+        """Return self & other, the ids in both sets."""
+
+        return self.__combined(other, lambda in_a, in_b: in_a and in_b)
+
     def __contains__(self, item):
         """Return True if item is an id in self."""
 
         if isinstance(item, int):
-            for r in self.__range:
-                if item in r:
+            if self.__normalized:
+                i = bisect_right(self.__first, item) - 1
+                return i >= 0 and item < self.__first[i] + self.__count[i]
+            for first, count in zip(self.__first, self.__count):
+                if first <= item < first + count:
                     return True
         return False
 
@@ -55,7 +81,9 @@ class IdRangeSet(object):
         """Return self[key]."""
 
         if isinstance(key, int):
-            return self.__range[key]
+            if Config.intern_ranges:
+                return IdRange.intern(self.__first[key], self.__count[key])
+            return IdRange(self.__first[key], self.__count[key])
         else:
             raise TypeError(
                     "{} indices must be integers, not {}".format(
@@ -64,25 +92,344 @@ class IdRangeSet(object):
                         )
                     )
 
+    def __iand__(self, other):
+        """Implement self &= other."""
+
+        return self.__combine(other, lambda in_a, in_b: in_a and in_b)
+
+    def __ior__(self, other):
+        """Implement self |= other."""
+
+        return self.__combine(other, lambda in_a, in_b: in_a or in_b)
+
+    def __isub__(self, other):
+        """Implement self -= other."""
+
+        return self.__combine(other, lambda in_a, in_b: in_a and not in_b)
+
     def __iter__(self):
         """Implement iter(self)."""
 
         return IdRangeSetIterator(self)
 
+    def __ixor__(self, other):
+        """Implement self ^= other."""
+
+        return self.__combine(other, lambda in_a, in_b: in_a != in_b)
+
     def __len__(self):
         """Return the number of ranges in the set."""
 
-        return len(self.__range)
+        return len(self.__first)
+
+    def __or__(self, other):
+        """Return self | other, the ids in any of the sets."""
+
+        return self.__combined(other, lambda in_a, in_b: in_a or in_b)
 
     def __str__(self):
         """Return str(self)."""
 
         return "{}()".format(self.__class__.__name__)
 
+    def __sub__(self, other):
+        """Return self - other, the ids in self but not in other."""
+
+        return self.__combined(other, lambda in_a, in_b: in_a and not in_b)
+
+    def __xor__(self, other):
+        """Return self ^ other, the ids in exactly one of the sets."""
+
+        return self.__combined(other, lambda in_a, in_b: in_a != in_b)
+
     # Miscellaneous
     ###############
 
-    __slots__ = ['_IdRangeSet__range']
+    __slots__ = [
+            '_IdRangeSet__count',
+            '_IdRangeSet__first',
+            '_IdRangeSet__normalized',
+            '_IdRangeSet__sorted',
+            '_IdRangeSet__watchers'
+            ]
+
+    # Private methods
+    #################
+
+    def __append_normalized(self, first, count):
+        """Merge a range into the sorted and disjoint ranges of the set."""
+
+        last = first + count - 1
+
+        # Ranges overlapping or adjacent to the new one
+        lo = bisect_left(self.__first, first)
+        if lo > 0 and self.__first[lo-1] + self.__count[lo-1] >= first:
+            lo -= 1
+        hi = bisect_right(self.__first, last + 1)
+
+        if lo < hi:
+            last = max(last, self.__first[hi-1] + self.__count[hi-1] - 1)
+            first = min(first, self.__first[lo])
+
+        self.__first[lo:hi] = array('Q', [first])
+        self.__count[lo:hi] = array('Q', [last - first + 1])
+
+    def __remove_normalized(self, first, last):
+        """Cut the ids from first to last out of the sorted ranges."""
+
+        # Ranges overlapping the removed ids
+        lo = bisect_right(self.__first, first) - 1
+        if lo < 0 or self.__first[lo] + self.__count[lo] <= first:
+            lo += 1
+        hi = bisect_right(self.__first, last)
+        if lo >= hi:
+            return
+
+        new_first = array('Q')
+        new_count = array('Q')
+        if self.__first[lo] < first:
+            new_first.append(self.__first[lo])
+            new_count.append(first - self.__first[lo])
+        hi_end = self.__first[hi-1] + self.__count[hi-1]
+        if last + 1 < hi_end:
+            new_first.append(last + 1)
+            new_count.append(hi_end - last - 1)
+
+        self.__first[lo:hi] = new_first
+        self.__count[lo:hi] = new_count
+
+    def __combine(self, other, keep):
+        """
+        Replace the ranges of the set by the ids selected by keep (see
+        __sweep) and return the set, or NotImplemented if other is not an
+        IdRangeSet object.
+        """
+
+        if not isinstance(other, IdRangeSet):
+            return NotImplemented
+
+        self.__first, self.__count = self.__sweep(other, keep)
+        self.__notify()
+
+        return self
+
+    def __combined(self, other, keep):
+        """
+        Return a new set, normalized as self is, holding the ids selected
+        by keep (see __sweep), or NotImplemented if other is not an
+        IdRangeSet object.
+        """
+
+        if not isinstance(other, IdRangeSet):
+            return NotImplemented
+
+        return IdRangeSet._from_columns(
+                *self.__sweep(other, keep),
+                normalized=self.__normalized
+                )
+
+    def __merge(self):
+        """Sort the ranges of the set and merge the overlapping ones."""
+
+        self.__first, self.__count = self.__merged()
+
+    def __merged(self):
+        """
+        Return two new arrays holding the first ids and the counts of the
+        sorted and merged ranges of the set.
+        """
+
+        new_first = array('Q')
+        new_count = array('Q')
+        if not self.__first:
+            return new_first, new_count
+
+        # Sort the ranges
+        ranges = sorted(zip(self.__first, self.__count))
+        cur_first, cur_end = ranges[0][0], ranges[0][0] + ranges[0][1]
+
+        for r_first, r_count in ranges:
+            if r_first <= cur_end:
+                # Overlapping or consecutive ranges
+                cur_end = max(cur_end, r_first + r_count)
+            else:
+                # No overlap, this is a new disjoint range
+                new_first.append(cur_first)
+                new_count.append(cur_end - cur_first)
+                cur_first, cur_end = r_first, r_first + r_count
+
+        # End of the last range
+        new_first.append(cur_first)
+        new_count.append(cur_end - cur_first)
+
+        return new_first, new_count
+
+    def __sweep(self, other, keep):
+        """
+        Return two new arrays holding the sorted and disjoint ranges of the
+        ids for which keep(in_a, in_b) is True, where in_a and in_b tell if
+        the id is in self and in other. The bounds of the merged ranges of
+        the two sets are walked together in a single pass.
+        """
+
+        a_first, a_count = self._merged_columns()
+        b_first, b_count = other._merged_columns()
+        a_len, b_len = len(a_first), len(b_first)
+
+        new_first = array('Q')
+        new_count = array('Q')
+        i = j = 0
+        in_a = in_b = False
+        start = None
+        while i < a_len or j < b_len:
+            # Next bound of each set
+            if i < a_len:
+                a_pos = a_first[i] + a_count[i] if in_a else a_first[i]
+            else:
+                a_pos = None
+            if j < b_len:
+                b_pos = b_first[j] + b_count[j] if in_b else b_first[j]
+            else:
+                b_pos = None
+
+            if b_pos is None or (a_pos is not None and a_pos <= b_pos):
+                pos = a_pos
+            else:
+                pos = b_pos
+
+            if a_pos == pos:
+                if in_a:
+                    i += 1
+                in_a = not in_a
+            if b_pos == pos:
+                if in_b:
+                    j += 1
+                in_b = not in_b
+
+            if keep(in_a, in_b):
+                if start is None:
+                    start = pos
+            elif start is not None:
+                new_first.append(start)
+                new_count.append(pos - start)
+                start = None
+
+        return new_first, new_count
+
+    def __notify(self, first=None, count=None, added=True):
+        """
+        Invalidate the indexes watching the set, or let them update if
+        only the count ids from first were added or removed.
+        """
+
+        self.__sorted = None
+        for watcher in self.__watchers:
+            update = getattr(watcher, 'update', None)
+            if first is None or update is None:
+                watcher.invalidate()
+            else:
+                update(self, first, count, added)
+
+    # Protected methods
+    ###################
+
+    def _add_watcher(self, watcher):
+        """
+        Register watcher, an object with an invalidate() method, to be
+        notified each time the ids in the set change. If the watcher also
+        has an update(id_range_set, first, count, added) method, it is
+        called instead when a single range is added or removed.
+        """
+
+        if not any(w is watcher for w in self.__watchers):
+            self.__watchers.append(watcher)
+
+    def _columns(self):
+        """
+        Return the two arrays storing the first ids and the counts of the
+        ranges in the set. They must not be modified.
+        """
+
+        return self.__first, self.__count
+
+    def _assign(self, firsts, counts):
+        """
+        Replace the ranges of the set by the ranges given by the parallel
+        arrays firsts and counts, which are assumed to be valid. Return
+        True if the ranges of the set changed.
+        """
+
+        if self.__normalized:
+            other = IdRangeSet._from_columns(firsts, counts)
+            other.__merge()
+            firsts, counts = other.__first, other.__count
+
+        if firsts == self.__first and counts == self.__count:
+            return False
+
+        self.__first = array('Q', firsts)
+        self.__count = array('Q', counts)
+        self.__notify()
+
+        return True
+
+    def _extend(self, firsts, counts):
+        """
+        Add to the set the ranges given by the parallel arrays firsts and
+        counts. The ranges are assumed to be valid and are not checked.
+        """
+
+        if not firsts:
+            return
+
+        if not self.__normalized:
+            self.__first.extend(firsts)
+            self.__count.extend(counts)
+        elif len(firsts) == 1:
+            self.__append_normalized(firsts[0], counts[0])
+        else:
+            self.__first.extend(firsts)
+            self.__count.extend(counts)
+            self.__merge()
+        self.__notify()
+
+    def _merged_columns(self):
+        """
+        Return two arrays holding the first ids and the counts of the
+        ranges of the set once sorted and merged, as simplify would do,
+        without changing the set. They must not be modified. The merged
+        ranges of a set which is not normalized are kept until it changes.
+        """
+
+        if self.__normalized:
+            return self.__first, self.__count
+
+        if self.__sorted is None:
+            self.__sorted = self.__merged()
+
+        return self.__sorted
+
+    @classmethod
+    def _from_columns(cls, firsts, counts, normalized=False, watcher=None):
+        """
+        Return a new set owning the arrays firsts and counts as its columns
+        and watched by watcher if it is not None. The ranges are assumed
+        to be valid, and sorted and disjoint if normalized is True.
+        """
+
+        id_range_set = cls.__new__(cls)
+        id_range_set.__count = counts
+        id_range_set.__first = firsts
+        id_range_set.__normalized = normalized
+        id_range_set.__sorted = None
+        id_range_set.__watchers = [] if watcher is None else [watcher]
+
+        return id_range_set
+
+    def _discard_watcher(self, watcher):
+        """Stop notifying watcher about the changes of the set."""
+
+        self.__watchers = [w for w in self.__watchers if w is not watcher]
 
     # Public methods
     ################
@@ -93,12 +440,93 @@ class IdRangeSet(object):
         starting at id first.
         """
 
-        self.__range.append(IdRange(first, count))
+        # Check the arguments as an IdRange would do
+        id_range = IdRange(first, count)
+        if id_range.last >= 1 << 64:
+            raise ValueError(
+                    "{}.append() ids cannot exceed {}".format(
+                        self.__class__.__name__,
+                        (1 << 64) - 1
+                        )
+                    )
+
+        if self.__normalized:
+            self.__append_normalized(first, count)
+        else:
+            self.__first.append(first)
+            self.__count.append(count)
+        self.__notify(first, count)
 
     def clear(self):
         """Remove all ranges of ids from the set."""
 
-        del self.__range[:]
+        del self.__first[:]
+        del self.__count[:]
+        self.__notify()
+
+    def contains_many(self, ids):
+        """
+        Return a list telling for each id of the sequence ids if it is in
+        the set, or an array of booleans if ids is a NumPy array. With
+        NumPy, all the ids are searched in the sorted ranges at once.
+        """
+
+        firsts, counts = self._merged_columns()
+        numpy = subordinate_numpy()
+
+        converted = subordinate_id_array(ids)
+        if converted is None:
+            lasts = [first + count - 1 for first, count in zip(firsts, counts)]
+            mask = []
+            for subid in map(subordinate_int, ids):
+                if subid is None:
+                    mask.append(False)
+                else:
+                    i = bisect_right(firsts, subid) - 1
+                    mask.append(i >= 0 and subid <= lasts[i])
+            if numpy is not None and isinstance(ids, numpy.ndarray):
+                return numpy.array(mask, dtype=bool)
+            return mask
+        id_array, valid = converted
+
+        if firsts:
+            first_array = numpy.frombuffer(firsts, dtype='uint64')
+            last_array = first_array + (
+                    numpy.frombuffer(counts, dtype='uint64') - 1
+                    )
+            i = first_array.searchsorted(id_array, 'right') - 1
+            mask = (i >= 0) & (id_array <= last_array[numpy.maximum(i, 0)])
+            if valid is not None:
+                mask &= valid
+        else:
+            mask = numpy.zeros(len(id_array), dtype=bool)
+
+        return mask if isinstance(ids, numpy.ndarray) else mask.tolist()
+
+    def overlapping(self, first, count):
+        """
+        Return the list of the ranges of the set, once sorted and merged as
+        simplify would do, sharing at least one id with the range of count
+        consecutive ids starting at id first. The ranges are found by a
+        binary search on the sorted ranges, which are kept between calls
+        if the set is not normalized.
+        """
+
+        end = first + count
+        if end <= first:
+            return []
+
+        firsts, counts = self._merged_columns()
+        i = bisect_right(firsts, first) - 1
+        if i < 0 or firsts[i] + counts[i] <= first:
+            i += 1
+
+        ranges = []
+        while i < len(firsts) and firsts[i] < end:
+            ranges.append(IdRange(firsts[i], counts[i]))
+            i += 1
+
+        return ranges
 
     def remove(self, first, count):
         """
@@ -110,20 +538,82 @@ class IdRangeSet(object):
         if first < 0 or count < 1:
             return
 
-        new_range = []
         last = first + count - 1
-        for r in self.__range:
-            if first <= r.last and r.first <= last:
+        if self.__normalized:
+            self.__remove_normalized(first, last)
+            self.__notify(first, count, False)
+            return
+
+        new_first = array('Q')
+        new_count = array('Q')
+        for r_first, r_count in zip(self.__first, self.__count):
+            r_last = r_first + r_count - 1
+            if first <= r_last and r_first <= last:
                 # There is an overlap
-                if r.first < first:
-                    new_range.append(IdRange(r.first, first-r.first))
-                if last < r.last:
-                    new_range.append(IdRange(last+1, r.last-last))
+                if r_first < first:
+                    new_first.append(r_first)
+                    new_count.append(first - r_first)
+                if last < r_last:
+                    new_first.append(last + 1)
+                    new_count.append(r_last - last)
             else:
                 # No overlap, range is kept
-                new_range.append(r)
+                new_first.append(r_first)
+                new_count.append(r_count)
+
+        self.__first = new_first
+        self.__count = new_count
+        self.__notify(first, count, False)
 
-        self.__range = new_range
+    def remove_many(self, ranges):
+        """
+        Remove the ranges of ids given by ranges, an iterable of IdRange
+        objects such as an IdRangeSet, from all the ranges in the set.
+        The removed ranges are sorted and merged, then each range of the
+        set is cut by the removed ranges it overlaps in a single pass.
+        """
+
+        if isinstance(ranges, IdRangeSet):
+            rem_first, rem_count = ranges._merged_columns()
+        else:
+            removed = IdRangeSet()
+            for id_range in ranges:
+                removed.append(id_range.first, id_range.count)
+            rem_first, rem_count = removed.__merged()
+
+        # Avoid trivialities
+        if not rem_first or not self.__first:
+            return
+
+        rem_end = [first + count for first, count in zip(rem_first, rem_count)]
+        new_first = array('Q')
+        new_count = array('Q')
+        changed = False
+        for r_first, r_count in zip(self.__first, self.__count):
+            r_end = r_first + r_count
+            k = bisect_right(rem_end, r_first)
+            if k == len(rem_end) or rem_first[k] >= r_end:
+                # No overlap, range is kept
+                new_first.append(r_first)
+                new_count.append(r_count)
+                continue
+
+            changed = True
+            start = r_first
+            while k < len(rem_end) and rem_first[k] < r_end:
+                if start < rem_first[k]:
+                    new_first.append(start)
+                    new_count.append(rem_first[k] - start)
+                start = rem_end[k]
+                k += 1
+            if start < r_end:
+                new_first.append(start)
+                new_count.append(r_end - start)
+
+        if changed:
+            self.__first = new_first
+            self.__count = new_count
+            self.__notify()
 
     def simplify(self):
         """
@@ -131,32 +621,19 @@ class IdRangeSet(object):
         is unique and that there is not overlap between to ranges.
         """
 
-        # Sort the ranges
-        self.__range.sort()
-
-        new_range = []
-        new_first = self.__range[0].first
-        new_count = self.__range[0].count
-
-        for r in self.__range:
-            if r.first == new_first:
-                # Longest range starting at new_first
-                new_count = r.count
-            elif r.first <= new_first + new_count:
-                # Overlapping ranges
-                if new_first + new_count - 1 < r.last:
-                    # There is a part of the range to add to the new range
-                    new_count = r.last - new_first + 1
-            else:
-                # No overlap, this is a new disjoint range
-                new_range.append(IdRange(new_first, new_count))
-                new_first = r.first
-                new_count = r.count
+        # Nothing to do on a normalized set
+        if not self.__normalized:
+            self.__merge()
 
-        # End of the last range
-        new_range.append(IdRange(new_first, new_count))
+    # Properties
+    ############
 
-        self.__range = new_range
+    normalized = property(
+            lambda self: self.__normalized,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'normalized'"
+            )
 
 
 class IdRangeSetIterator(object):
@@ -193,9 +670,15 @@ class IdRangeSetIterator(object):
     def __next__(self):
         """Implement next(self)."""
 
-        if self.__current + 1 < len(self.__set):
+        first, count = self.__set._columns()
+        if self.__current + 1 < len(first):
             self.__current += 1
-            return self.__set[self.__current]
+            if Config.intern_ranges:
+                return IdRange.intern(
+                        first[self.__current],
+                        count[self.__current]
+                        )
+            return IdRange(first[self.__current], count[self.__current])
         else:
             raise StopIteration
 
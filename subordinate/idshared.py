@@ -0,0 +1,351 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdSharedMap class definition."""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from subordinate.idindex import IdIndex
+from subordinate.idrangeset import IdRangeSet
+from subordinate.utils import subordinate_no_del, subordinate_no_set
+
+class IdSharedMap(object):
+    """
+    IdSharedMap(shm_name) -> IdSharedMap object
+
+    Returns a read only view of an id map exported in the POSIX shared
+    memory segment shm_name by IdSharedMap.export. The names, the ranges
+    and the reverse index of the map are stored in the segment as packed
+    arrays which are searched in place, so that the processes attached to
+    it share one copy of the map and parse nothing.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self, shm_name):
+        """
+        Constructor method.
+        The segment is mapped read only. It is not created nor removed by
+        the attached processes, only by the exporting one.
+        """
+
+        self.__buffer = None
+        self.__shm = None
+        with open(os.path.join(self.SHM_DIR, shm_name), 'rb') as shm_file:
+            buffer = mmap.mmap(
+                    shm_file.fileno(), 0,
+                    access=mmap.ACCESS_READ
+                    )
+
+        self.__attach(shm_name, buffer)
+
+    # Special methods
+    #################
+
+    def __contains__(self, name):
+        """Return name in self."""
+
+        return self.__find(name) >= 0
+
+    def __del__(self):
+        """Detach the map from the segment when it is dropped."""
+
+        self.close()
+
+    def __enter__(self):
+        """Return self at the start of a with statement."""
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Detach the map from the segment at the end of a with statement."""
+
+        self.close()
+
+    def __getitem__(self, name):
+        """Return self[name]."""
+
+        i = self.__find(name)
+        if i < 0:
+            raise KeyError(name)
+
+        return self.__ranges(i)
+
+    def __len__(self):
+        """Return len(self)."""
+
+        return len(self.__name_ends)
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}({!r})".format(self.__class__.__name__, self.__name)
+
+    # Miscellaneous
+    ###############
+
+    # File signature, followed by the byte order of the arrays
+    MAGIC = b'SUBIDM1' + sys.byteorder[0].encode()
+
+    # Number of names, ranges, index segments and index owners, then the
+    # size of the names
+    HEADER = struct.Struct('<QQQQQ')
+
+    # Directory of the POSIX shared memory segments on Linux
+    SHM_DIR = '/dev/shm'
+
+    __slots__ = [
+            '_IdSharedMap__blob',
+            '_IdSharedMap__bounds',
+            '_IdSharedMap__buffer',
+            '_IdSharedMap__counts',
+            '_IdSharedMap__firsts',
+            '_IdSharedMap__name',
+            '_IdSharedMap__name_ends',
+            '_IdSharedMap__order',
+            '_IdSharedMap__owner_ends',
+            '_IdSharedMap__owners',
+            '_IdSharedMap__range_ends',
+            '_IdSharedMap__shm',
+            '_IdSharedMap__views'
+            ]
+
+    # Private methods
+    #################
+
+    def __attach(self, shm_name, buffer):
+        """
+        Read the header of the exported map in buffer, the content of the
+        segment shm_name, and map its arrays.
+        """
+
+        view = memoryview(buffer)
+        start = len(self.MAGIC) + self.HEADER.size
+        if len(view) < start or view[:len(self.MAGIC)] != self.MAGIC:
+            view.release()
+            raise ValueError(
+                    "segment {!r} does not hold an id map".format(shm_name)
+                    )
+
+        sizes = self.HEADER.unpack_from(view, len(self.MAGIC))
+        nnames, nranges, nsegments, nowners, names_size = sizes
+        lengths = (
+                nnames, nnames, nnames, nranges, nranges,
+                nsegments, nsegments, nowners
+                )
+        end = start + 8 * sum(lengths)
+        ints = view[start:end].cast('Q')
+        views = [view, ints]
+        pos = 0
+        for length in lengths:
+            views.append(ints[pos:pos+length])
+            pos += length
+        views.append(view[end:end+names_size])
+
+        (self.__name_ends, self.__order, self.__range_ends, self.__firsts,
+                self.__counts, self.__bounds, self.__owner_ends,
+                self.__owners, self.__blob) = views[2:]
+        self.__buffer = buffer
+        self.__name = shm_name
+        self.__views = views
+
+    def __find(self, name):
+        """Return the index of name, or -1 if it is not in the map."""
+
+        try:
+            key = os.fsencode(name)
+        except (TypeError, UnicodeError):
+            return -1
+
+        # Binary search in the names sorted as bytes
+        order = self.__order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__key(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.__key(order[lo]) == key:
+            return order[lo]
+
+        return -1
+
+    def __key(self, i):
+        """Return the name of index i as bytes."""
+
+        start = self.__name_ends[i-1] if i else 0
+
+        return self.__blob[start:self.__name_ends[i]].tobytes()
+
+    def __ranges(self, i):
+        """Return a copy of the id range set of the name of index i."""
+
+        start = self.__range_ends[i-1] if i else 0
+        end = self.__range_ends[i]
+
+        return IdRangeSet._from_columns(
+                array('Q', self.__firsts[start:end]),
+                array('Q', self.__counts[start:end])
+                )
+
+    # Public methods
+    ################
+
+    def close(self):
+        """
+        Detach the map from the segment, which is left as it is. The map is
+        also detached when it is dropped or at the end of a with statement,
+        and closing it again does nothing.
+        """
+
+        if self.__buffer is None:
+            return
+        for view in reversed(self.__views):
+            view.release()
+        self.__views = []
+        if self.__shm is not None:
+            self.__shm.close()
+        else:
+            self.__buffer.close()
+        self.__buffer = None
+
+    @classmethod
+    def export(cls, id_map, shm_name=None):
+        """
+        Export the names, the ranges and the reverse index of id_map, an
+        IdMap object, in a new shared memory segment named shm_name, or
+        with a random name if it is None, and return an IdSharedMap object
+        attached to it. The segment is removed by unlink or when the
+        exporting process ends.
+        """
+
+        # Imported on demand, it needs Python 3.8
+        from multiprocessing.shared_memory import SharedMemory
+
+        names = id_map.names()
+        id_range_sets = [id_map[name] for name in names]
+        index = IdIndex()
+        index.rebuild(dict(zip(names, id_range_sets)))
+        bounds, owners = index._segments()
+        if bounds and bounds[-1] >> 64:
+            # The bound past the last id only ends the last segment
+            bounds, owners = bounds[:-1], owners[:-1]
+
+        keys = [os.fsencode(name) for name in names]
+        rank = dict(zip(names, range(len(names))))
+        firsts = array('Q')
+        counts = array('Q')
+        range_ends = array('Q')
+        for id_range_set in id_range_sets:
+            columns = id_range_set._columns()
+            firsts.extend(columns[0])
+            counts.extend(columns[1])
+            range_ends.append(len(firsts))
+        owner_ids = array('Q')
+        owner_ends = array('Q')
+        for segment_owners in owners:
+            owner_ids.extend(rank[name] for name in segment_owners)
+            owner_ends.append(len(owner_ids))
+
+        blob = b''.join(keys)
+        arrays = (
+                array('Q', accumulate(map(len, keys))),
+                array('Q', sorted(range(len(keys)), key=keys.__getitem__)),
+                range_ends, firsts, counts, array('Q', bounds),
+                owner_ends, owner_ids
+                )
+        header = cls.HEADER.pack(
+                len(names), len(firsts), len(bounds), len(owner_ids),
+                len(blob)
+                )
+        content = [cls.MAGIC, header]
+        content.extend(values.tobytes() for values in arrays)
+        content.append(blob)
+        content = b''.join(content)
+
+        shm = SharedMemory(shm_name, create=True, size=len(content))
+        try:
+            shm.buf[:len(content)] = content
+            shared_map = cls.__new__(cls)
+            shared_map.__buffer = None
+            shared_map.__shm = shm
+            shared_map.__attach(shm.name, shm.buf)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+        return shared_map
+
+    def get(self, name, default=None):
+        """
+        Return a copy of the id range set of name if name is in the map,
+        else default.
+        """
+
+        i = self.__find(name)
+
+        return self.__ranges(i) if i >= 0 else default
+
+    def names(self):
+        """Return a list containing the names in the map."""
+
+        return [os.fsdecode(self.__key(i)) for i in range(len(self))]
+
+    def unlink(self):
+        """
+        Remove the segment, which is freed once every process is detached
+        from it. Only the exporting process should call this method.
+        """
+
+        if self.__shm is None:
+            raise ValueError("only the exported map can remove its segment")
+        self.__shm.unlink()
+
+    def who_has(self, subid):
+        """Return a list of names who own subid in their id range set."""
+
+        if not isinstance(subid, int):
+            return []
+
+        i = bisect_right(self.__bounds, subid) - 1
+        if i < 0:
+            return []
+        start = self.__owner_ends[i-1] if i else 0
+
+        return [
+                os.fsdecode(self.__key(j))
+                for j in self.__owners[start:self.__owner_ends[i]]
+                ]
+
+    # Properties
+    ############
+
+    name = property(
+            lambda self: self.__name,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'name'"
+            )
@@ -0,0 +1,198 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+"""IdSource class definition."""
+
+import os
+from array import array
+
+from subordinate.idparser import decode_names, parse_block
+from subordinate.utils import (
+        subordinate_no_del, subordinate_no_set, subordinate_stat_key
+        )
+
+class IdSource(object):
+    """
+    IdSource(id_filename, id_stat=None, names=(), canonical=None)
+        -> IdSource object
+
+    Returns a tracker of the changes of the id file id_filename whose
+    status, as given by os.stat, was id_stat and whose names were names
+    when it was last read. The lines of the file are cut into chunks at
+    content defined boundaries and each chunk is fingerprinted, so that a
+    line inserted or removed only changes the chunk around it. If
+    canonical is not None, it is called with the list of the names of a
+    chunk and returns the list of the keys under which they are reported,
+    such as IdNames.canonical_many.
+    """
+
+    # Constructor
+    #############
+
+    def __init__(self, id_filename, id_stat=None, names=(), canonical=None):
+        """
+        Constructor method.
+        The chunks of the file are unknown until the first refresh, which
+        reports all the names of the file.
+        """
+
+        self.__canonical = canonical
+        self.__chunks = None
+        self.__filename = id_filename
+        self.__key = None
+        self.__names = tuple(names)
+        if id_stat is not None:
+            self.__key = subordinate_stat_key(id_stat)
+
+    # Special methods
+    #################
+
+    def __str__(self):
+        """Return str(self)."""
+
+        return "{}({!r})".format(self.__class__.__name__, self.__filename)
+
+    # Miscellaneous
+    ###############
+
+    # A line ends a chunk when the low bits of its hash are all zero, so
+    # chunks have 256 lines on average
+    CHUNK_MASK = 0xff
+
+    __slots__ = [
+            '_IdSource__canonical',
+            '_IdSource__chunks',
+            '_IdSource__filename',
+            '_IdSource__key',
+            '_IdSource__names'
+            ]
+
+    # Public methods
+    ################
+
+    def refresh(self):
+        """
+        Read the id file again if its status changed since the last time.
+        Return None if it did not change, else a tuple (ranges, gone) where
+        ranges is a dictionary mapping each name whose lines may have
+        changed to a tuple (firsts, counts) of arrays of its ranges and
+        gone is the set of the names which are not in the file anymore.
+        Raise BadIdFile if the file is not correctly formatted.
+        """
+
+        with open(self.__filename, 'rb') as id_file:
+            key = subordinate_stat_key(os.fstat(id_file.fileno()))
+            if key == self.__key:
+                return None
+            data = id_file.read()
+
+        lines = data.split(b'\n')
+        if lines[-1] == b'':
+            del lines[-1]
+
+        # Only needed to reload, do not import it with the module
+        import hashlib
+
+        # Cut the lines into chunks and fingerprint them
+        ends = [
+                i+1 for i, h in enumerate(map(hash, lines))
+                if not h & self.CHUNK_MASK
+                ]
+        if lines and (not ends or ends[-1] != len(lines)):
+            ends.append(len(lines))
+
+        chunks = []
+        start = 0
+        for end in ends:
+            raw = b'\n'.join(lines[start:end])
+            digest = hashlib.blake2b(raw, digest_size=16).digest()
+            chunks.append((digest, start, raw))
+            start = end
+
+        # Parse the new chunks, their names and the names of the chunks
+        # which disappeared may have changed
+        old_chunks = self.__chunks or {}
+        parsed = {}
+        dirty = set(self.__names)
+        for digest, start, raw in chunks:
+            if digest not in old_chunks and digest not in parsed:
+                parsed[digest] = self.__parse(raw, start)
+                dirty.update(parsed[digest][0])
+        new_digests = set(digest for digest, _, _ in chunks)
+        for digest, names in old_chunks.items():
+            if digest not in new_digests:
+                dirty.update(names)
+
+        # Gather the ranges of the dirty names in the order of the file
+        ranges = {}
+        for digest, start, raw in chunks:
+            if digest in parsed:
+                names = parsed[digest][0]
+            else:
+                names = old_chunks[digest]
+            if dirty.isdisjoint(names):
+                continue
+
+            if digest not in parsed:
+                parsed[digest] = self.__parse(raw, start)
+            for name, first, count in zip(*parsed[digest]):
+                if name in dirty:
+                    columns = ranges.get(name)
+                    if columns is None:
+                        columns = ranges[name] = (array('Q'), array('Q'))
+                    columns[0].append(first)
+                    columns[1].append(count)
+
+        self.__chunks = dict(
+                (digest, frozenset(parsed[digest][0]) if digest in parsed
+                    else old_chunks[digest])
+                for digest, _, _ in chunks
+                )
+        self.__key = key
+        self.__names = ()
+
+        return ranges, dirty.difference(ranges)
+
+    # Private methods
+    #################
+
+    def __parse(self, raw, start):
+        """
+        Parse raw, the lines of a chunk starting after the line start of
+        the file, and return a tuple (names, firsts, counts) of lists.
+        """
+
+        names, firsts, counts = parse_block(
+                raw + b'\n',
+                self.__filename,
+                start
+                )
+        names = decode_names([names])
+        if self.__canonical is not None:
+            names = self.__canonical(names)
+
+        return names, firsts, counts
+
+    # Properties
+    ############
+
+    filename = property(
+            lambda self: self.__filename,
+            subordinate_no_set,
+            subordinate_no_del,
+            doc="Read only attribute 'filename'"
+            )
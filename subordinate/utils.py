@@ -17,6 +17,8 @@
 
 """Utilities for Subordinate."""
 
+from operator import index
+
 class BadIdFile(Exception):
     """
     BadIdFile(id_filename, lineno, message) -> BadIdFile object
@@ -43,6 +45,15 @@ class BadIdFile(Exception):
 
         self.id_filename = id_filename
         self.lineno = lineno
+        self.message = message
+
+    # Special methods
+    #################
+
+    def __reduce__(self):
+        """Return the arguments to rebuild self when it is pickled."""
+
+        return self.__class__, (self.id_filename, self.lineno, self.message)
 
 class Config(object):
     """
@@ -55,6 +66,81 @@ class Config(object):
     user_sub_id_file = '/etc/subuid'
     group_sub_id_file = '/etc/subgid'
 
+    # Default bounds and size of the ranges given by an allocation (see
+    # SUB_UID_MIN, SUB_UID_MAX and SUB_UID_COUNT in login.defs)
+    sub_id_min = 100000
+    sub_id_max = 600100000
+    sub_id_count = 65536
+
+    # Maximal number of lines of '/proc/<pid>/uid_map' and gid_map (340
+    # since Linux 4.15, 5 before)
+    max_map_extents = 340
+
+    # Read the id files through a memory map
+    use_mmap = False
+
+    # Share the equal IdRange objects given by the id range sets (see
+    # IdRange.intern)
+    intern_ranges = False
+
+    # Let UserIdMap and GroupIdMap find a name under its numeric id and
+    # conversely (see IdNames), with a cache of name_cache_size answers
+    resolve_names = False
+    name_cache_size = 4096
+
+    # Number of processes parsing a large id file (see IdMap.read)
+    parse_workers = 1
+
+    # Postpone the reading of the id files given to UserIdMap and
+    # GroupIdMap until the maps are used
+    lazy_load = False
+
+    # Directory of the binary caches of the parsed id files (no cache
+    # if None)
+    cache_dir = None
+
+def subordinate_id_array(ids):
+    """
+    Return a tuple (id_array, valid) where id_array holds the items of
+    ids, a sequence of integers, as a NumPy array of unsigned 64 bits
+    integers. The negative items, which are no ids, are replaced by 0 and
+    valid is then a boolean array telling which items are ids, else it is
+    None. Return None if NumPy is not available or if some item of ids is
+    not an integer.
+    """
+
+    numpy = subordinate_numpy()
+    if numpy is None:
+        return None
+
+    try:
+        id_array = numpy.asarray(ids)
+    except (OverflowError, TypeError, ValueError):
+        return None
+    if id_array.ndim != 1:
+        return None
+    valid = None
+    if id_array.dtype.kind == 'i':
+        negative = id_array < 0
+        if negative.any():
+            valid = ~negative
+            id_array = numpy.where(negative, 0, id_array)
+    elif id_array.dtype.kind != 'u':
+        return None
+
+    return id_array.astype(numpy.uint64, copy=False), valid
+
+def subordinate_int(value):
+    """
+    Return value as an int if it is an integer, such as a NumPy integer
+    scalar, or None if it is not.
+    """
+
+    try:
+        return index(value)
+    except TypeError:
+        return None
+
 def subordinate_no_del(name):
     """Function raising AttributeError on del for read only attribute."""
 
@@ -64,3 +150,36 @@ def subordinate_no_set(name, value):
     """Function raising AttributeError on set for read only attribute."""
 
     raise AttributeError("readonly attribute")
+
+# NumPy module, False until subordinate_numpy is called
+_numpy = False
+
+def subordinate_numpy():
+    """
+    Return the numpy module, imported on the first call, or None if it is
+    not available. NumPy is optional and only speeds up the batch queries.
+    """
+
+    global _numpy
+
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+
+    return _numpy
+
+def subordinate_stat_key(id_stat):
+    """
+    Return the values of id_stat, as given by os.stat, which identify a
+    version of a file: its device, inode, size and modification time.
+    """
+
+    return (
+            id_stat.st_dev,
+            id_stat.st_ino,
+            id_stat.st_size,
+            id_stat.st_mtime_ns
+            )
@@ -0,0 +1,88 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from subordinate.idcache import IdCache
+from subordinate.idmap import IdMap
+from subordinate.idparser import decode_names, parse_block
+
+class TestIdCache(TestCase):
+
+    def test_load_and_save(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'wb') as id_file:
+                id_file.write(b'a:10:5\nb:20:5\n')
+            id_stat = os.stat(id_filename)
+
+            cache = IdCache(os.path.join(tmp_dir, 'cache'))
+            self.assertIsNone(cache.load(id_filename, id_stat))
+
+            names, firsts, counts = parse_block(b'a:10:5\nb:20:5\n', 'f')
+            self.assertTrue(
+                    cache.save(id_filename, id_stat, ([names], firsts, counts))
+                    )
+            names, firsts, counts = cache.load(id_filename, id_stat)
+            self.assertEqual(decode_names(names), ['a', 'b'])
+            self.assertEqual(list(firsts), [10, 20])
+            self.assertEqual(list(counts), [5, 5])
+
+            # A cache is stale once the id file changes
+            with open(id_filename, 'ab') as id_file:
+                id_file.write(b'c:30:5\n')
+            self.assertIsNone(cache.load(id_filename, os.stat(id_filename)))
+
+            # A corrupted cache is ignored
+            with open(cache.path(id_filename), 'r+b') as cache_file:
+                cache_file.truncate(20)
+            self.assertIsNone(cache.load(id_filename, id_stat))
+
+    def test_cached_map(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'wb') as id_file:
+                id_file.write(b'a:10:5\nb:20:5\n')
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            cache = IdCache(cache_dir)
+
+            m = IdMap()
+            m.read(id_filename, cache_dir=cache_dir)
+            self.assertTrue(os.path.exists(cache.path(id_filename)))
+
+            # The map is loaded from the cache while it is fresh
+            os.utime(id_filename, ns=(0, 0))
+            m.read(id_filename, cache_dir=cache_dir)
+            id_stat = os.stat(id_filename)
+            names, firsts, counts = cache.load(id_filename, id_stat)
+            firsts[0] = 15
+            cache.save(id_filename, id_stat, (names, firsts, counts))
+
+            m = IdMap()
+            m.read(id_filename, cache_dir=cache_dir)
+            self.assertEqual(m.write_string(), 'a:15:5\nb:20:5')
+
+            # An empty file is cached too
+            open(id_filename, 'w').close()
+            m = IdMap()
+            m.read(id_filename, cache_dir=cache_dir)
+            m.read(id_filename, cache_dir=cache_dir)
+            self.assertEqual(len(m), 0)
@@ -0,0 +1,77 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from subordinate.idfreespace import IdFreeSpace
+
+class TestIdFreeSpace(TestCase):
+
+    def test_clipping(self):
+
+        free = IdFreeSpace([(0, 20), (30, 10), (50, 100)], 10, 59)
+        self.assertEqual(free.extents(), [(10, 10), (30, 10), (50, 10)])
+        self.assertEqual(len(free), 3)
+
+    def test_policies(self):
+
+        gaps = [(0, 10), (20, 5), (40, 8), (60, 20)]
+
+        free = IdFreeSpace(gaps, 0, 100)
+        self.assertEqual(free.allocate(6), 0)
+        self.assertEqual(free.allocate(6), 40)
+        self.assertEqual(free.allocate(4), 6)
+        self.assertEqual(free.allocate(21), None)
+        self.assertEqual(
+                free.extents(),
+                [(20, 5), (46, 2), (60, 20)]
+                )
+
+        free = IdFreeSpace(gaps, 0, 100)
+        self.assertEqual(free.allocate(5, 'best'), 20)
+        self.assertEqual(free.allocate(7, 'best'), 40)
+        self.assertEqual(free.allocate(1, 'best'), 47)
+        self.assertEqual(free.allocate(1, 'best'), 0)
+
+        free = IdFreeSpace(gaps, 0, 100)
+        self.assertEqual(free.allocate(6, 'next'), 0)
+        self.assertEqual(free.allocate(6, 'next'), 40)
+        self.assertEqual(free.allocate(2, 'next'), 46)
+        self.assertEqual(free.allocate(2, 'next'), 60)
+        self.assertEqual(free.allocate(5, 'next'), 62)
+        self.assertEqual(free.allocate(15, 'next'), None)
+        self.assertEqual(free.allocate(13, 'next'), 67)
+        self.assertEqual(free.allocate(4, 'next'), 6)
+        self.assertEqual(free.cursor, 10)
+
+        # The next fit policy may start from any id
+        free = IdFreeSpace(gaps, 0, 100, 22)
+        self.assertEqual(free.allocate(2, 'next'), 20)
+        free = IdFreeSpace(gaps, 0, 100, 30)
+        self.assertEqual(free.allocate(2, 'next'), 40)
+        free = IdFreeSpace(gaps, 0, 100, 90)
+        self.assertEqual(free.allocate(2, 'next'), 0)
+
+        with self.assertRaises(ValueError):
+            free.allocate(1, 'worst')
+
+    def test_empty(self):
+
+        free = IdFreeSpace([], 0, 100)
+        self.assertEqual(len(free), 0)
+        self.assertIsNone(free.allocate(1))
+        self.assertIsNone(free.allocate(1, 'best'))
@@ -0,0 +1,151 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from subordinate.idindex import IdIndex
+from subordinate.idrangeset import IdRangeSet
+
+class TestIdIndex(TestCase):
+
+    def test_rebuild(self):
+
+        a = IdRangeSet()
+        a.append(10, 10)
+        a.append(15, 10)
+        b = IdRangeSet()
+        b.append(20, 10)
+        b.append(40, 5)
+
+        index = IdIndex()
+        self.assertFalse(index.valid)
+        index.rebuild({'a': a, 'b': b})
+        self.assertTrue(index.valid)
+
+        self.assertEqual(index.who_has(9), [])
+        self.assertEqual(index.who_has(10), ['a'])
+        self.assertEqual(index.who_has(19), ['a'])
+        self.assertEqual(index.who_has(20), ['a', 'b'])
+        self.assertEqual(index.who_has(24), ['a', 'b'])
+        self.assertEqual(index.who_has(25), ['b'])
+        self.assertEqual(index.who_has(30), [])
+        self.assertEqual(index.who_has(44), ['b'])
+        self.assertEqual(index.who_has(45), [])
+        self.assertEqual(index.who_has('20'), [])
+
+    def test_watched_set(self):
+
+        s = IdRangeSet()
+        index = IdIndex()
+        s._add_watcher(index)
+        index.rebuild({'a': s})
+
+        s.append(10, 5)
+        self.assertTrue(index.valid)
+        self.assertEqual(index.who_has(12), ['a'])
+
+        s.clear()
+        self.assertFalse(index.valid)
+        index.rebuild({'a': s})
+        s.append(10, 5)
+
+        s._discard_watcher(index)
+        s.remove(12, 1)
+        self.assertTrue(index.valid)
+
+    def test_update(self):
+
+        a = IdRangeSet()
+        a.append(10, 10)
+        b = IdRangeSet()
+        b.append(15, 10)
+        index = IdIndex()
+        index.rebuild({'a': a, 'b': b})
+        a._add_watcher(index)
+        b._add_watcher(index)
+
+        a.append(30, 5)
+        b.remove(16, 2)
+        a.remove(0, 12)
+        self.assertTrue(index.valid)
+        self.assertEqual(
+                [index.who_has(i) for i in (11, 12, 15, 16, 18, 31, 35)],
+                [[], ['a'], ['a', 'b'], ['a'], ['a', 'b'], ['a'], []]
+                )
+        self.assertEqual(list(index.gaps(0, 39)), [(0, 12), (25, 5), (35, 5)])
+
+        # A gap left by two removals is allocated as a whole
+        a.remove(30, 2)
+        a.remove(32, 3)
+        self.assertEqual(list(index.gaps(25, 39)), [(25, 15)])
+        self.assertEqual(index.allocate('c', 15, 25, 39), 25)
+        bounds, owners = index._segments()
+        self.assertEqual(bounds, sorted(bounds))
+        self.assertEqual(
+                [index.who_has(i) for i in (24, 25, 32, 39, 40)],
+                [['b'], ['c'], ['c'], ['c'], []]
+                )
+
+        # Ids owned by another name, the order of the owners is unknown
+        b.append(32, 10)
+        self.assertFalse(index.valid)
+
+    def test_gaps_and_allocate(self):
+
+        a = IdRangeSet()
+        a.append(10, 10)
+        b = IdRangeSet()
+        b.append(20, 10)
+        b.append(40, 5)
+
+        index = IdIndex()
+        index.rebuild({'a': a, 'b': b})
+        self.assertEqual(
+                list(index.gaps()),
+                [(0, 10), (30, 10), (45, None)]
+                )
+        self.assertEqual(list(index.gaps(15, 42)), [(30, 10)])
+        self.assertEqual(list(index.gaps(35, 100)), [(35, 5), (45, 56)])
+
+        self.assertEqual(index.allocate('c', 10, 0, 100), 0)
+        self.assertEqual(index.allocate('c', 10, 0, 100), 30)
+        self.assertIsNone(index.allocate('c', 100, 0, 100))
+        self.assertEqual(index.who_has(35), ['c'])
+        self.assertEqual(list(index.gaps(0, 100)), [(45, 56)])
+
+    def test_next_fit(self):
+
+        a = IdRangeSet()
+        a.append(10, 10)
+        b = IdRangeSet()
+        b.append(20, 10)
+        b.append(40, 5)
+
+        index = IdIndex()
+        index.rebuild({'a': a, 'b': b})
+        self.assertEqual(index.allocate('c', 5, 0, 100, 'next'), 0)
+        self.assertEqual(index.allocate('c', 5, 0, 100, 'next'), 5)
+        self.assertEqual(index.allocate('c', 5, 0, 100, 'next'), 30)
+
+        # The cursor is kept when the index changes or is rebuilt
+        b.remove(20, 10)
+        self.assertEqual(index.allocate('c', 5, 0, 100, 'next'), 35)
+        index.invalidate()
+        index.rebuild({'a': a, 'b': b})
+        self.assertEqual(index.allocate('c', 5, 0, 100, 'next'), 45)
+        self.assertEqual(index.allocate('c', 5, 0, 100), 0)
+        self.assertEqual(index.allocate('c', 5, 0, 100, 'next'), 5)
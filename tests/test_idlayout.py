@@ -0,0 +1,62 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from subordinate.idlayout import IdLayout, format_map, newidmap_args
+from subordinate.idrangeset import IdRangeSet
+
+class TestIdLayout(TestCase):
+
+    def test_extents(self):
+
+        s = IdRangeSet()
+        s.append(1000, 10)
+        s.append(100, 50)
+        s.append(2000, 30)
+        s.append(130, 40)
+        layout = IdLayout(s)
+
+        # Largest ranges first, laid out in the order of the ids
+        self.assertEqual(layout.extents(70), [(0, 100, 70)])
+        self.assertEqual(
+                layout.extents(75),
+                [(0, 100, 70), (70, 2000, 5)]
+                )
+        self.assertEqual(
+                layout.extents(105, 1),
+                [(1, 100, 70), (71, 1000, 5), (76, 2000, 30)]
+                )
+        with self.assertRaises(ValueError):
+            layout.extents(105, 0, 2)
+        with self.assertRaises(ValueError):
+            layout.extents(111)
+        with self.assertRaises(ValueError):
+            layout.extents(10, (1 << 32) - 10)
+
+        # Changes of the set are seen
+        s.append(3000, 200)
+        self.assertEqual(layout.extents(105), [(0, 3000, 105)])
+
+    def test_formatting(self):
+
+        extents = [(0, 100, 70), (70, 2000, 5)]
+        self.assertEqual(format_map(extents), '0 100 70\n70 2000 5\n')
+        self.assertEqual(
+                newidmap_args(extents),
+                ['0', '100', '70', '70', '2000', '5']
+                )
@@ -15,9 +15,16 @@
 # You should have received a copy of the GNU General Public License
 # along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
 
-from unittest import TestCase
+import os
+import pwd
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
 
-from subordinate.idmap import IdMap
+from subordinate.idmap import IdMap, UserIdMap
+from subordinate.idnames import IdNames
+from subordinate.idrange import IdRange
+from subordinate.utils import BadIdFile, subordinate_numpy
 
 class TestIdMap(TestCase):
 
@@ -61,3 +68,616 @@ class TestIdMap(TestCase):
 
         m = IdMap()
         self.assertEqual(m.write_string(), '')
+
+    def test_who_has_follows_changes(self):
+
+        m = IdMap()
+        m.append('a')
+        m.append('b')
+        m['a'].append(10, 10)
+        m['b'].append(15, 10)
+        self.assertEqual(m.who_has(12), ['a'])
+        self.assertEqual(m.who_has(17), ['a', 'b'])
+
+        # Changes made through the id range sets are seen
+        m['a'].remove(15, 5)
+        self.assertEqual(m.who_has(17), ['b'])
+        m['b'].clear()
+        self.assertEqual(m.who_has(17), [])
+
+        # Changes made through the map are seen
+        m['b'].append(10, 1)
+        self.assertEqual(m.who_has(10), ['a', 'b'])
+        s = m['a']
+        m.remove('a')
+        self.assertEqual(m.who_has(10), ['b'])
+        m.clear()
+        self.assertEqual(m.who_has(10), [])
+        s.append(10, 1)
+        self.assertEqual(m.who_has(10), [])
+
+    def test_who_has_many(self):
+
+        m = IdMap()
+        self.assertEqual(m.who_has_many([0, 1]), [(), ()])
+        m.append('a')
+        m.append('b')
+        m['a'].append(10, 10)
+        m['b'].append(15, 10)
+        m['b'].append((1 << 64) - 1, 1)
+        self.assertEqual(
+                m.who_has_many(
+                    [9, 10, 17, 24, 25, (1 << 64) - 1, -1, 'x']
+                    ),
+                [(), ('a',), ('a', 'b'), ('b',), (), ('b',), (), ()]
+                )
+        self.assertEqual(
+                m.who_has_many(range(9, 12)),
+                [(), ('a',), ('a',)]
+                )
+
+        # Changes are seen
+        m['a'].clear()
+        self.assertEqual(m.who_has_many([17]), [('b',)])
+
+    @skipIf(subordinate_numpy() is None, "NumPy is not available")
+    def test_who_has_many_numpy(self):
+
+        numpy = subordinate_numpy()
+        m = IdMap()
+        m.append('a')
+        m['a'].append(10, 10)
+        m.append('b')
+        m['b'].append((1 << 64) - 1, 1)
+
+        for dtype in ('int64', 'uint64'):
+            self.assertEqual(
+                    m.who_has_many(numpy.array([9, 10, 19], dtype=dtype)),
+                    [(), ('a',), ('a',)]
+                    )
+        self.assertEqual(
+                m.who_has_many(numpy.array([-1, 10, -5, 20])),
+                [(), ('a',), (), ()]
+                )
+        self.assertEqual(
+                m.who_has_many(numpy.array([(1 << 64) - 1], dtype='uint64')),
+                [('b',)]
+                )
+        self.assertEqual(
+                m.who_has_many([numpy.int64(-1), numpy.int64(10), 1.5]),
+                [(), ('a',), ()]
+                )
+
+    def test_resolver(self):
+
+        uid = os.getuid()
+        user = pwd.getpwuid(uid).pw_name
+        m = IdMap(resolver=IdNames('passwd'))
+        m.append(str(uid))
+        m.append(user + 'x')
+        m[str(uid)].append(10, 5)
+
+        # A name is found under its numeric id and conversely
+        self.assertTrue(user in m)
+        self.assertIs(m[user], m[str(uid)])
+        self.assertIs(m.get(user), m[str(uid)])
+        self.assertEqual(m.names(), [user, user + 'x'])
+        self.assertIsNone(m.get('no such user:'))
+        self.assertFalse(user in IdMap())
+        self.assertEqual(m.namespace_map(str(uid), 5), [(0, 10, 5)])
+        m.remove(str(uid))
+        self.assertFalse(user in m)
+
+        # The lines of both forms are read under the name
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'w') as id_file:
+                id_file.write('{0}:10:5\nb:20:5\n{1}:30:5\n'.format(
+                    str(uid), user
+                    ))
+
+            for lazy in (False, True):
+                m = UserIdMap(id_filename, lazy=lazy, resolve=True)
+                self.assertEqual(
+                        list(m[user]),
+                        [IdRange(10, 5), IdRange(30, 5)]
+                        )
+                self.assertIs(m[str(uid)], m[user])
+                self.assertEqual(m.names(), [user, 'b'])
+                self.assertEqual(
+                        m.write_string(),
+                        '{0}:10:5\n{0}:30:5\nb:20:5'.format(user)
+                        )
+
+            with open(id_filename, 'w') as id_file:
+                id_file.write('{0}:10:5\nb:20:5\n{1}:40:5\n'.format(
+                    str(uid), user
+                    ))
+            self.assertEqual(m.reload(), [user])
+            self.assertEqual(list(m[user]), [IdRange(10, 5), IdRange(40, 5)])
+
+            m = IdMap(resolver=IdNames('passwd'))
+            m.read_many([id_filename])
+            self.assertEqual(sorted(m.names()), sorted([user, 'b']))
+            self.assertEqual(len(m.origins(str(uid))), 2)
+
+    def test_who_overlaps(self):
+
+        m = IdMap()
+        self.assertEqual(m.who_overlaps(0, 100), [])
+        for name, first, count in (
+                ('a', 50, 10), ('b', 10, 10), ('c', 15, 50), ('d', 100, 1)
+                ):
+            m.append(name)
+            m[name].append(first, count)
+
+        self.assertEqual(m.who_overlaps(0, 10), [])
+        self.assertEqual(m.who_overlaps(0, 11), ['b'])
+        self.assertEqual(m.who_overlaps(12, 40), ['b', 'c', 'a'])
+        self.assertEqual(m.who_overlaps(59, 100), ['a', 'c', 'd'])
+        self.assertEqual(m.who_overlaps(65, 35), [])
+        self.assertEqual(m.who_overlaps(100, 0), [])
+        self.assertEqual(m.who_overlaps(55, 0), [])
+        self.assertEqual(m.who_overlaps(55, -1), [])
+
+    def test_normalized_map(self):
+
+        m = IdMap(normalized=True)
+        m.append('test')
+        self.assertTrue(m['test'].normalized)
+        m['test'].append(20, 5)
+        m['test'].append(10, 10)
+        self.assertEqual(m.write_string(), 'test:10:15')
+
+        # The ranges read from a file are sorted and merged too
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'w') as id_file:
+                id_file.write('a:30:5\nb:40:1\na:10:5\na:12:10\n')
+
+            for lazy, cache_dir, fetch in (
+                    (False, '', False), (True, '', False),
+                    (True, '', True), (False, tmp_dir, False),
+                    (False, tmp_dir, False)
+                    ):
+                m = IdMap(normalized=True)
+                m.read(id_filename, cache_dir=cache_dir, lazy=lazy)
+                if fetch:
+                    self.assertTrue(31 in m['a'])
+                self.assertEqual(
+                        list(m['a']),
+                        [IdRange(10, 12), IdRange(30, 5)]
+                        )
+                self.assertTrue(31 in m['a'])
+                self.assertEqual(m.who_has(13), ['a'])
+                self.assertEqual(m.conflicts(), [])
+
+    def test_read(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'w') as id_file:
+                id_file.write('a:10:5\nb:20:5\na:30:5\n')
+
+            m = IdMap()
+            m.read(id_filename)
+            self.assertEqual(m.names(), ['a', 'b'])
+            self.assertEqual(len(m['a']), 2)
+            self.assertEqual(m.who_has(32), ['a'])
+            self.assertEqual(m.write_string(), 'a:10:5\na:30:5\nb:20:5')
+
+            # The ranges of a name keep the order of the file
+            other_filename = os.path.join(tmp_dir, 'other')
+            with open(other_filename, 'w') as id_file:
+                id_file.write('b:1:1\na:30:5\nb:2:1\na:10:5\nb:0:1\n')
+            other = IdMap()
+            other.read(other_filename)
+            other.read(other_filename)
+            self.assertEqual(
+                    other.write_string(),
+                    'b:1:1\nb:2:1\nb:0:1\nb:1:1\nb:2:1\nb:0:1\n'
+                    'a:30:5\na:10:5\na:30:5\na:10:5'
+                    )
+            self.assertEqual(other.who_has(12), ['a'])
+
+            # The map is left unchanged by a bad file
+            with open(id_filename, 'a') as id_file:
+                id_file.write('c:40\n')
+            with self.assertRaises(BadIdFile) as cm:
+                m.read(id_filename)
+            self.assertEqual(cm.exception.lineno, 4)
+            self.assertEqual(len(m['a']), 2)
+            self.assertFalse('c' in m)
+
+    def test_read_mmap(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            open(id_filename, 'w').close()
+
+            m = IdMap()
+            m.read(id_filename, use_mmap=True)
+            self.assertEqual(len(m), 0)
+
+            with open(id_filename, 'w') as id_file:
+                id_file.write('a:10:5\nb:20:5\na:30:5')
+            m.read(id_filename, use_mmap=True)
+            self.assertEqual(m.write_string(), 'a:10:5\na:30:5\nb:20:5')
+
+    def test_read_lazy(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'w') as id_file:
+                id_file.write('a:10:5\nab:20:5\nb:30:x\na:40:5')
+
+            # Nothing is read on create
+            m = UserIdMap(id_filename, lazy=True)
+            os.utime(id_filename, ns=(0, 0))
+
+            # Looking up a name only parses its lines
+            self.assertEqual(list(m['a']), [IdRange(10, 5), IdRange(40, 5)])
+            self.assertTrue('ab' in m)
+            self.assertIsNone(m.get('c'))
+            self.assertFalse('a:10' in m)
+            self.assertIsNone(m.get('a:10'))
+            self.assertIsNone(m.get('a:10:5\nab'))
+            with self.assertRaises(BadIdFile) as cm:
+                m.get('b')
+            self.assertEqual(cm.exception.lineno, 3)
+
+            # Other uses read the whole file, fetched sets are kept
+            s = m['a']
+            s.append(50, 5)
+            with self.assertRaises(BadIdFile):
+                len(m)
+            with open(id_filename, 'w') as id_file:
+                id_file.write('a:10:5\nab:20:5\nb:30:5\na:40:5')
+            m = UserIdMap(id_filename, lazy=True)
+            s = m['a']
+            s.append(50, 5)
+            self.assertEqual(m.names(), ['a', 'ab', 'b'])
+            self.assertIs(m['a'], s)
+            self.assertEqual(m.who_has(52), ['a'])
+            self.assertEqual(m.reload(), [])
+            self.assertFalse('a:10' in m)
+            self.assertEqual(
+                    m.write_string(),
+                    'a:10:5\na:40:5\na:50:5\nab:20:5\nb:30:5'
+                    )
+
+            m.clear()
+            self.assertEqual(len(m), 0)
+
+    def test_read_many(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'w') as id_file:
+                id_file.write('b:100:10\na:30:10\na:0:10\n')
+            fragments = os.path.join(tmp_dir, 'subuid.d')
+            os.mkdir(fragments)
+            for entry, content in (
+                    ('20-b', 'b:105:10\nc:500:1'),
+                    ('10-a', 'a:10:5\n'),
+                    ('.hidden', 'bad'),
+                    ('10-a~', 'bad')
+                    ):
+                with open(os.path.join(fragments, entry), 'w') as id_file:
+                    id_file.write(content)
+
+            m = IdMap()
+            m.append('c')
+            m['c'].append(0, 1)
+            m.read_many([id_filename, fragments])
+            self.assertEqual(
+                    m.write_string(),
+                    'c:0:1\nc:500:1\na:0:15\na:30:10\nb:100:15'
+                    )
+            self.assertEqual(m.who_has(112), ['b'])
+
+            # The file of each line is known
+            fragment = os.path.join(fragments, '20-b')
+            self.assertEqual(
+                    m.origins('b'),
+                    [(IdRange(100, 10), id_filename),
+                        (IdRange(105, 10), fragment)]
+                    )
+            self.assertEqual(m.origins('d'), [])
+
+            # A bad file leaves the map unchanged
+            with open(os.path.join(fragments, '30-d'), 'w') as id_file:
+                id_file.write('d:1:1\nd:2\n')
+            with self.assertRaises(BadIdFile) as cm:
+                m.read_many([fragments])
+            self.assertEqual(cm.exception.lineno, 2)
+            self.assertFalse('d' in m)
+            self.assertEqual(len(m.origins('b')), 2)
+
+    def test_reload(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            lines = ['user{}:{}:10\n'.format(i, 10*i) for i in range(2000)]
+            with open(id_filename, 'w') as id_file:
+                id_file.write(''.join(lines))
+
+            m = IdMap()
+            with self.assertRaises(ValueError):
+                m.reload()
+            m.read(id_filename)
+            self.assertEqual(m.reload(), [])
+
+            # Only the changed names are updated
+            kept = m['user1500']
+            lines[10] = 'user10:30000:20\n'
+            del lines[20]
+            lines.append('new:50000:10\n')
+            with open(id_filename, 'w') as id_file:
+                id_file.write(''.join(lines))
+            os.utime(id_filename, ns=(0, 0))
+            self.assertEqual(m.reload(), ['new', 'user10', 'user20'])
+            self.assertIs(m['user1500'], kept)
+            self.assertEqual(m.who_has(30015), ['user10'])
+            self.assertEqual(m.who_has(105), [])
+            self.assertFalse('user20' in m)
+
+            # The chunks are known after the first reload
+            lines[1499] = 'user1500:60000:1\n'
+            lines.insert(0, 'user20:200:10\n')
+            with open(id_filename, 'w') as id_file:
+                id_file.write(''.join(lines))
+            self.assertEqual(m.reload(), ['user1500', 'user20'])
+            self.assertIs(m['user1500'], kept)
+            self.assertEqual(m.who_has(60000), ['user1500'])
+            self.assertEqual(m.who_has(200), ['user20'])
+
+            # A bad file leaves the map unchanged
+            with open(id_filename, 'a') as id_file:
+                id_file.write('bad\n')
+            with self.assertRaises(BadIdFile) as cm:
+                m.reload()
+            self.assertEqual(cm.exception.lineno, len(lines) + 1)
+            self.assertEqual(len(m), 2001)
+
+    def test_diff(self):
+
+        m1 = IdMap()
+        m2 = IdMap(normalized=True)
+        for m, lines in (
+                (m1, [('a', 0, 10), ('a', 20, 10), ('b', 100, 10),
+                    ('c', 200, 10), ('d', 300, 10)]),
+                (m2, [('a', 25, 10), ('a', 0, 10), ('c', 200, 10),
+                    ('d', 305, 10), ('e', 400, 10)])
+                ):
+            for name, first, count in lines:
+                m.append(name)
+                m[name].append(first, count)
+        m2.append('f')
+
+        diff = m1.diff(m2)
+        self.assertEqual(
+                diff,
+                {
+                    'a': ([IdRange(30, 5)], [IdRange(20, 5)]),
+                    'b': None,
+                    'd': ([IdRange(310, 5)], [IdRange(300, 5)]),
+                    'e': ([IdRange(400, 10)], []),
+                    'f': ([], [])
+                    }
+                )
+        self.assertEqual(m1.diff(m1), {})
+
+        # Applying the diff gives the same ids
+        c = m1['c']
+        m1.apply(diff)
+        self.assertEqual(m1.diff(m2), {})
+        self.assertEqual(m1.names(), ['a', 'c', 'd', 'e', 'f'])
+        self.assertIs(m1['c'], c)
+        self.assertEqual(m1.who_has(32), ['a'])
+        self.assertEqual(m1.who_has(22), [])
+
+    def test_namespace_map(self):
+
+        m = IdMap()
+        m.append('a')
+        m['a'].append(100000, 65536)
+        m['a'].append(300000, 10)
+        self.assertEqual(m.namespace_map('a'), [(0, 100000, 65536)])
+        self.assertEqual(
+                m.namespace_map('a', 65540, 1),
+                [(1, 100000, 65536), (65537, 300000, 4)]
+                )
+        with self.assertRaises(ValueError):
+            m.namespace_map('a', 65540, limit=1)
+        with self.assertRaises(KeyError):
+            m.namespace_map('b')
+
+        # The layout follows the changes of the map
+        m['a'].remove(100000, 1)
+        self.assertEqual(
+                m.namespace_map('a'),
+                [(0, 100001, 65535), (65535, 300000, 1)]
+                )
+        m.remove('a')
+        m.append('a')
+        with self.assertRaises(ValueError):
+            m.namespace_map('a')
+
+    def test_remove_ranges(self):
+
+        m = IdMap()
+        m.append('a')
+        m.append('b')
+        m['a'].append(0, 100)
+        m['b'].append(100, 100)
+        self.assertEqual(m.who_has(150), ['b'])
+
+        m.remove_ranges([IdRange(150, 10), IdRange(50, 60)])
+        self.assertEqual(m.write_string(), 'a:0:50\nb:110:40\nb:160:40')
+        self.assertEqual(m.who_has(150), [])
+        self.assertEqual(m.who_has(160), ['b'])
+
+    def test_stats(self):
+
+        m = IdMap()
+        self.assertEqual(
+                m.stats(0, 99),
+                {
+                    'names': 0, 'ranges': 0, 'ranges_per_name': 0.0,
+                    'max_ranges_per_name': 0, 'allocated': 0, 'shared': 0,
+                    'free': 100, 'largest_free': 100, 'fragmentation': 0.0
+                    }
+                )
+
+        for name, first, count in (
+                ('a', 10, 10), ('a', 40, 10), ('a', 45, 10), ('b', 15, 10),
+                ('c', 200, 10)
+                ):
+            m.append(name)
+            m[name].append(first, count)
+        m.append('d')
+
+        stats = m.stats(0, 99)
+        self.assertEqual(stats['names'], 4)
+        self.assertEqual(stats['ranges'], 5)
+        self.assertEqual(stats['ranges_per_name'], 1.25)
+        self.assertEqual(stats['max_ranges_per_name'], 3)
+        self.assertEqual(stats['allocated'], 40)
+        self.assertEqual(stats['shared'], 5)
+        self.assertEqual(stats['free'], 70)
+        self.assertEqual(stats['largest_free'], 45)
+        self.assertEqual(stats['fragmentation'], 1 - 45 / 70)
+
+        stats = m.stats(100, 209)
+        self.assertEqual(stats['free'], 100)
+        self.assertEqual(stats['largest_free'], 100)
+
+    def test_write(self):
+
+        m = IdMap()
+        m.append('a')
+        m.append('b')
+        for i in range(100):
+            m['a'].append(10*i, 5)
+        m['b'].append(5000, 10)
+        content = m.write_string() + '\n'
+
+        id_file = StringIO()
+        m.write_file(id_file, 7)
+        self.assertEqual(id_file.getvalue(), content)
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            m.write(id_filename)
+            with open(id_filename) as id_file:
+                self.assertEqual(id_file.read(), content)
+            self.assertEqual(os.stat(id_filename).st_mode & 0o777, 0o644)
+
+            # The file is replaced and keeps its permissions
+            os.chmod(id_filename, 0o600)
+            m.remove('a')
+            m.write(id_filename)
+            with open(id_filename) as id_file:
+                self.assertEqual(id_file.read(), 'b:5000:10\n')
+            self.assertEqual(os.stat(id_filename).st_mode & 0o777, 0o600)
+            self.assertEqual(os.listdir(tmp_dir), ['subuid'])
+
+    def test_allocate(self):
+
+        m = IdMap()
+        m.append('a')
+        m['a'].append(100000, 65536)
+        m['a'].append(300000, 1000)
+
+        self.assertEqual(m.allocate('b'), IdRange(165536, 65536))
+        self.assertEqual(m.allocate('c', 1000), IdRange(231072, 1000))
+        self.assertEqual(m.who_has(231072), ['c'])
+        self.assertEqual(m.who_has(165535), ['a'])
+
+        # Allocations follow the changes made to the map
+        m['a'].remove(100000, 10)
+        self.assertEqual(
+                m.allocate('d', 10, policy='best'),
+                IdRange(100000, 10)
+                )
+        self.assertEqual(m.allocate('b', 10, 0, 99999), IdRange(0, 10))
+        self.assertEqual(len(m['b']), 2)
+
+        # No room left
+        with self.assertRaises(ValueError):
+            m.allocate('e', 10, 100000, 100009)
+        self.assertFalse('e' in m)
+        with self.assertRaises(ValueError):
+            m.allocate('e', 10, policy='worst')
+        with self.assertRaises(ValueError):
+            m.allocate('e', 0)
+
+    def test_allocate_many(self):
+
+        m = IdMap()
+        m.append('a')
+        m['a'].append(100000, 65536)
+
+        ranges = m.allocate_many(
+                [('b', None), ('c', 10), ('b', 10)],
+                policy='first'
+                )
+        self.assertEqual(
+                ranges,
+                [IdRange(165536, 65536), IdRange(231072, 10),
+                    IdRange(231082, 10)]
+                )
+        self.assertEqual(len(m['b']), 2)
+        self.assertEqual(m.who_has(231085), ['b'])
+
+        # Nothing is allocated if a request does not fit
+        with self.assertRaises(ValueError):
+            m.allocate_many([('d', 10), ('e', 100)], 0, 99)
+        self.assertFalse('d' in m)
+        self.assertEqual(
+                m.allocate_many([('d', 10)], 0, 99),
+                [IdRange(0, 10)]
+                )
+        with self.assertRaises(TypeError):
+            m.allocate_many([(1, 10)])
+
+    def test_compaction_plan(self):
+
+        m = IdMap()
+        for name, first, count in (
+                ('a', 0, 10), ('b', 5, 5), ('c', 20, 10), ('c', 40, 5),
+                ('d', 32, 3), ('d', 50, 10)
+                ):
+            m.append(name)
+            m[name].append(first, count)
+        m.append('e')
+
+        self.assertEqual(
+                m.compaction_plan(0, 99),
+                [('b', 5, 10, 5), ('c', 40, 30, 5), ('d', 32, 47, 3)]
+                )
+        self.assertEqual(len(m['c']), 2)
+        self.assertRaises(ValueError, m.compaction_plan, 0, 40)
+
+    def test_conflicts(self):
+
+        m = IdMap()
+        self.assertEqual(m.conflicts(), [])
+
+        for name, first, count in (
+                ('a', 0, 100), ('a', 50, 100), ('b', 120, 10),
+                ('b', 140, 10), ('c', 145, 20), ('d', 300, 10)
+                ):
+            m.append(name)
+            m[name].append(first, count)
+
+        self.assertEqual(
+                m.conflicts(),
+                [
+                    ('a', 'b', IdRange(120, 10)),
+                    ('a', 'b', IdRange(140, 10)),
+                    ('a', 'c', IdRange(145, 5)),
+                    ('b', 'c', IdRange(145, 5))
+                    ]
+                )
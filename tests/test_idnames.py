@@ -0,0 +1,91 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+import grp
+import os
+import pwd
+from unittest import TestCase
+
+from subordinate.idnames import IdNames
+
+class TestIdNames(TestCase):
+
+    def test_alias(self):
+
+        uid = os.getuid()
+        user = pwd.getpwuid(uid).pw_name
+        users = IdNames('passwd', 2)
+        self.assertEqual(users.alias(str(uid)), user)
+        self.assertEqual(users.alias(user), str(uid))
+        self.assertIsNone(users.alias('no such user:'))
+        self.assertIsNone(users.alias(str(1 << 40)))
+        self.assertIsNone(users.alias(uid))
+
+        # The cache is bounded
+        self.assertEqual(len(users), 2)
+        users.clear()
+        self.assertEqual(len(users), 0)
+
+        gid = os.getgid()
+        groups = IdNames('group')
+        self.assertEqual(groups.alias(str(gid)), grp.getgrgid(gid).gr_name)
+
+        with self.assertRaises(ValueError):
+            IdNames('shadow')
+        with self.assertRaises(ValueError):
+            IdNames('passwd', 0)
+
+    def test_alias_many(self):
+
+        uid = os.getuid()
+        user = pwd.getpwuid(uid).pw_name
+        keys = [user, str(uid), 'no such user:', user]
+        expected = [str(uid), user, None, str(uid)]
+
+        self.assertEqual(IdNames('passwd').alias_many(keys), expected)
+
+        # Many keys are found by reading the whole database
+        class EnumeratingIdNames(IdNames):
+            ENUMERATE_MIN = 1
+        users = EnumeratingIdNames('passwd')
+        self.assertEqual(users.alias_many(keys), expected)
+        self.assertEqual(len(users), 3)
+
+    def test_canonical(self):
+
+        uid = os.getuid()
+        user = pwd.getpwuid(uid).pw_name
+        users = IdNames('passwd')
+        self.assertEqual(users.canonical(str(uid)), user)
+        self.assertEqual(users.canonical(user), user)
+        self.assertEqual(users.canonical('0' + str(uid)), '0' + str(uid))
+        self.assertEqual(users.canonical(str(1 << 40)), str(1 << 40))
+
+        # Only the numeric ids are resolved, at once
+        class CountingIdNames(IdNames):
+            calls = []
+            def alias_many(self, keys):
+                self.calls.append(keys)
+                return super().alias_many(keys)
+        users = CountingIdNames('passwd')
+        self.assertEqual(
+                users.canonical_many([str(uid), user, 'x', str(uid)]),
+                [user, user, 'x', user]
+                )
+        self.assertEqual(users.calls, [[str(uid)]])
+        self.assertEqual(users.canonical_many(['x']), ['x'])
+        self.assertEqual(len(users.calls), 1)
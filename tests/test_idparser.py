@@ -0,0 +1,133 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from array import array
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from subordinate.idparser import (
+        decode_names, parse_block, parse_buffer, parse_file, parse_parallel
+        )
+from subordinate.utils import BadIdFile
+
+class TestIdParser(TestCase):
+
+    def test_parse_block(self):
+
+        names, firsts, counts = parse_block(b'a:10:5\nb:20:5\na:30:1\n', 'f')
+        self.assertEqual(decode_names([names]), ['a', 'b', 'a'])
+        self.assertEqual(list(firsts), [10, 20, 30])
+        self.assertEqual(list(counts), [5, 5, 1])
+
+        # Last line without newline and fields with spaces
+        names, firsts, counts = parse_block(b'a:10:5\n:20: 5\r', 'f')
+        self.assertEqual(decode_names([names]), ['a', ''])
+        self.assertEqual(list(counts), [5, 5])
+
+        names, firsts, counts = parse_block(b'', 'f')
+        self.assertEqual(decode_names([]), [])
+        self.assertEqual(len(firsts), 0)
+
+    def test_bad_lines(self):
+
+        for data, lineno in (
+                (b'a:10:5\n\nb:20:5\n', 2),
+                (b'a:10:5\nb:20:5:1\nc:2\n', 2),
+                (b'a:10\nb:20:5:1\n', 1),
+                (b'a:10:5\nb:x:5\n', 2),
+                (b'a:10:5\nb:-1:5\n', 2),
+                (b'a:10:0\n', 1),
+                (b'a:18446744073709551615:2\n', 1)
+                ):
+            with self.assertRaises(BadIdFile) as cm:
+                parse_block(data, 'f', 10)
+            self.assertEqual(cm.exception.id_filename, 'f')
+            self.assertEqual(cm.exception.lineno, 10 + lineno)
+
+    def test_parse_file(self):
+
+        data = b''.join(
+                'user{}:{}:10\n'.format(i, 10*i).encode() for i in range(100)
+                )
+
+        names, firsts, counts = parse_file(BytesIO(data), 'f', 64)
+        self.assertEqual(len(decode_names(names)), 100)
+        self.assertEqual(list(firsts), list(range(0, 1000, 10)))
+
+        # Line numbers are kept across blocks
+        with self.assertRaises(BadIdFile) as cm:
+            parse_file(BytesIO(data + b'bad\n' + data), 'f', 64)
+        self.assertEqual(cm.exception.lineno, 101)
+
+    def test_parse_buffer(self):
+
+        data = b''.join(
+                '{}:{}:10\n'.format('u'*i, 10*i).encode() for i in range(1, 50)
+                )
+
+        for block_size in (8, 64, 1 << 20):
+            names, firsts, counts = parse_buffer(data, 'f', block_size)
+            self.assertEqual(decode_names(names)[-1], 'u'*49)
+            self.assertEqual(list(firsts), list(range(10, 500, 10)))
+
+        # Line numbers are kept across windows
+        with self.assertRaises(BadIdFile) as cm:
+            parse_buffer(data + b'bad', 'f', 64)
+        self.assertEqual(cm.exception.lineno, 50)
+
+    def test_parse_parallel(self):
+
+        data = b''.join(
+                'user{}:{}:10\n'.format(i, 10*i).encode()
+                for i in range(1000)
+                )
+
+        with TemporaryDirectory() as tmp_dir:
+            id_filename = os.path.join(tmp_dir, 'subuid')
+            with open(id_filename, 'wb') as id_file:
+                id_file.write(data)
+
+            with open(id_filename, 'rb') as id_file:
+                names, firsts, counts = parse_parallel(
+                        id_file, id_filename, 2, 1000
+                        )
+            self.assertGreater(len(names), 1)
+            self.assertEqual(
+                    (b'\n'.join(names), firsts, counts),
+                    parse_block(data, id_filename)
+                    )
+
+            # Line numbers are those of the whole file
+            with open(id_filename, 'ab') as id_file:
+                id_file.write(b'bad:1\nuser:1:1')
+            with open(id_filename, 'rb') as id_file:
+                with self.assertRaises(BadIdFile) as cm:
+                    parse_parallel(id_file, id_filename, 3, 1000)
+            self.assertEqual(cm.exception.lineno, 1001)
+            self.assertEqual(
+                    cm.exception.message,
+                    'incorrect number of fields'
+                    )
+
+            open(id_filename, 'w').close()
+            with open(id_filename, 'rb') as id_file:
+                self.assertEqual(
+                        parse_parallel(id_file, id_filename, 2),
+                        ([], array('Q'), array('Q'))
+                        )
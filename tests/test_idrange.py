@@ -93,6 +93,23 @@ class TestIdRange(TestCase):
         with self.assertRaises(ValueError):
             t = IdRange(0, 0)
 
+    def test_hash(self):
+
+        # Equal ranges have the same hash and are deduplicated
+        t1 = IdRange(10, 5)
+        t2 = IdRange(10, 5)
+        self.assertEqual(hash(t1), hash(t2))
+        self.assertEqual(len(set([t1, t2, IdRange(10, 6)])), 2)
+        self.assertEqual({t1: 'a'}[t2], 'a')
+
+        # Interned ranges are shared while they are used
+        t3 = IdRange.intern(10, 5)
+        self.assertIs(IdRange.intern(10, 5), t3)
+        self.assertEqual(t3, t1)
+        self.assertIsNot(IdRange.intern(10, 6), t3)
+        with self.assertRaises(ValueError):
+            IdRange.intern(10, 0)
+
     def test_values_in_range(self):
 
         val_first = 10
@@ -15,10 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
 
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 from subordinate.idrange import IdRange
 from subordinate.idrangeset import IdRangeSet
+from subordinate.utils import Config, subordinate_numpy
 
 class TestIdRangeSet(TestCase):
 
@@ -89,3 +90,209 @@ class TestIdRangeSet(TestCase):
         self.assertEqual(s[0].last, 29)
         self.assertEqual(s[1].first, 40)
         self.assertEqual(s[1].last, 44)
+
+    def test_normalized_set(self):
+
+        s = IdRangeSet(normalized=True)
+        self.assertTrue(s.normalized)
+        with self.assertRaises(AttributeError):
+            s.normalized = False
+
+        # Ranges are kept sorted and disjoint
+        s.append(40, 5)
+        s.append(10, 5)
+        s.append(20, 5)
+        s.append(12, 10)
+        s.append(25, 1)
+        self.assertEqual(list(s), [IdRange(10, 16), IdRange(40, 5)])
+
+        # Removing ids keeps the set sorted
+        s.remove(12, 2)
+        s.remove(20, 21)
+        self.assertEqual(
+                list(s),
+                [IdRange(10, 2), IdRange(14, 6), IdRange(41, 4)]
+                )
+        s.remove(0, 5)
+        self.assertEqual(len(s), 3)
+
+        for val_id in (10, 11, 14, 19, 41, 44):
+            self.assertTrue(val_id in s)
+        for val_id in (9, 12, 13, 20, 40, 45):
+            self.assertFalse(val_id in s)
+
+        s.clear()
+        self.assertFalse(10 in s)
+        s.simplify()
+        self.assertEqual(len(s), 0)
+
+    def test_packed_storage(self):
+
+        s = IdRangeSet()
+        s.append(0, 1)
+        s.append((1 << 64) - 2, 2)
+        self.assertEqual(s[-1].last, (1 << 64) - 1)
+
+        # Ids must fit in the packed arrays
+        with self.assertRaises(ValueError):
+            s.append((1 << 64) - 1, 2)
+        with self.assertRaises(ValueError):
+            s.append(-1, 1)
+        with self.assertRaises(TypeError):
+            s.append('0', 1)
+        self.assertEqual(len(s), 2)
+
+        # Ranges are created on access
+        self.assertEqual(list(s), [s[0], s[1]])
+
+    def test_set_algebra(self):
+
+        a = IdRangeSet()
+        a.append(20, 10)
+        a.append(0, 10)
+        a.append(5, 10)
+        b = IdRangeSet(normalized=True)
+        b.append(10, 15)
+        b.append(40, 5)
+
+        self.assertEqual(list(a | b), [IdRange(0, 30), IdRange(40, 5)])
+        self.assertEqual(list(a & b), [IdRange(10, 5), IdRange(20, 5)])
+        self.assertEqual(list(a - b), [IdRange(0, 10), IdRange(25, 5)])
+        self.assertEqual(
+                list(a ^ b),
+                [IdRange(0, 10), IdRange(15, 5), IdRange(25, 5),
+                    IdRange(40, 5)]
+                )
+        self.assertFalse((a | b).normalized)
+        self.assertTrue((b | a).normalized)
+        self.assertEqual(len(a & IdRangeSet()), 0)
+        with self.assertRaises(TypeError):
+            a | [IdRange(0, 1)]
+
+        # In-place operators keep the set object
+        s = a
+        s -= b
+        self.assertIs(s, a)
+        self.assertEqual(list(a), [IdRange(0, 10), IdRange(25, 5)])
+        s |= b
+        s &= b
+        self.assertEqual(list(s), list(b))
+        s ^= b
+        self.assertEqual(len(s), 0)
+
+    def test_remove_many(self):
+
+        s = IdRangeSet()
+        s.append(50, 10)
+        s.append(0, 30)
+        s.append(20, 20)
+        s.remove_many([IdRange(25, 10), IdRange(5, 5), IdRange(8, 4)])
+        self.assertEqual(
+                list(s),
+                [IdRange(50, 10), IdRange(0, 5), IdRange(12, 13),
+                    IdRange(20, 5), IdRange(35, 5)]
+                )
+
+        # Normalized sets stay sorted and disjoint
+        n = IdRangeSet(normalized=True)
+        n.append(0, 100)
+        n.append(200, 10)
+        removed = IdRangeSet()
+        removed.append(90, 115)
+        removed.append(10, 10)
+        n.remove_many(removed)
+        self.assertEqual(
+                list(n),
+                [IdRange(0, 10), IdRange(20, 70), IdRange(205, 5)]
+                )
+        n.remove_many([])
+        self.assertEqual(len(n), 3)
+
+    def test_interned_ranges(self):
+
+        a = IdRangeSet()
+        a.append(10, 5)
+        b = IdRangeSet()
+        b.append(0, 5)
+        b.append(10, 5)
+        self.assertIsNot(a[0], b[1])
+
+        Config.intern_ranges = True
+        try:
+            self.assertIs(a[0], b[1])
+            self.assertIs(list(a)[0], list(b)[1])
+        finally:
+            Config.intern_ranges = False
+
+    def test_contains_many(self):
+
+        s = IdRangeSet()
+        s.append(20, 10)
+        s.append(0, 10)
+        s.append(5, 10)
+        s.append((1 << 64) - 2, 2)
+        ids = [0, 14, 15, 19, 29, 30, (1 << 64) - 1]
+        self.assertEqual(
+                s.contains_many(ids),
+                [True, True, False, False, True, False, True]
+                )
+        self.assertEqual(s.contains_many([-1, '0', 0]), [False, False, True])
+        self.assertEqual(IdRangeSet().contains_many([0, 1]), [False, False])
+        self.assertEqual(s.contains_many([]), [])
+
+    @skipIf(subordinate_numpy() is None, "NumPy is not available")
+    def test_contains_many_numpy(self):
+
+        numpy = subordinate_numpy()
+        s = IdRangeSet()
+        s.append(10, 10)
+        s.append((1 << 64) - 2, 2)
+
+        for dtype in ('int64', 'uint64', 'int32'):
+            mask = s.contains_many(numpy.array([9, 10, 19, 20], dtype=dtype))
+            self.assertIsInstance(mask, numpy.ndarray)
+            self.assertEqual(mask.tolist(), [False, True, True, False])
+        self.assertEqual(
+                s.contains_many(numpy.array([-1, 10, -20, 20])).tolist(),
+                [False, True, False, False]
+                )
+        self.assertEqual(
+                s.contains_many(
+                    numpy.array([(1 << 64) - 1, 0], dtype='uint64')
+                    ).tolist(),
+                [True, False]
+                )
+
+        # Lists of NumPy scalars are ids too
+        self.assertEqual(
+                s.contains_many([numpy.int64(-1), numpy.uint64(15), 'x']),
+                [False, True, False]
+                )
+        self.assertEqual(
+                s.contains_many(list(numpy.array([-1, 10]))),
+                [False, True]
+                )
+
+    def test_overlapping(self):
+
+        for normalized in (False, True):
+            s = IdRangeSet(normalized)
+            s.append(30, 10)
+            s.append(0, 10)
+            s.append(5, 10)
+            s.append(50, 1)
+
+            self.assertEqual(s.overlapping(15, 15), [])
+            self.assertEqual(
+                    s.overlapping(14, 17),
+                    [IdRange(0, 15), IdRange(30, 10)]
+                    )
+            self.assertEqual(
+                    s.overlapping(39, 20),
+                    [IdRange(30, 10), IdRange(50, 1)]
+                    )
+            self.assertEqual(s.overlapping(0, 0), [])
+
+            # The sorted ranges follow the changes of the set
+            s.remove(0, 14)
+            self.assertEqual(s.overlapping(0, 20), [IdRange(14, 1)])
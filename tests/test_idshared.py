@@ -0,0 +1,102 @@
+# This file is part of Subordinate
+#
+# Copyright (C) 2015 Xavier Gendre
+#
+# Subordinate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Subordinate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Subordinate. If not, see <http://www.gnu.org/licenses/>.
+
+import gc
+import sys
+from unittest import TestCase
+
+from subordinate.idmap import IdMap
+from subordinate.idrange import IdRange
+from subordinate.idshared import IdSharedMap
+
+class TestIdSharedMap(TestCase):
+
+    def test_export(self):
+
+        m = IdMap()
+        for name, first, count in (
+                ('b', 10, 10), ('a', 15, 10), ('b', 40, 5),
+                ('\udce9té', (1 << 64) - 1, 1)
+                ):
+            m.append(name)
+            m[name].append(first, count)
+        m.append('empty')
+
+        shared = IdSharedMap.export(m)
+        try:
+            attached = IdSharedMap(shared.name)
+            for s in (shared, attached):
+                self.assertEqual(len(s), 4)
+                self.assertEqual(s.names(), m.names())
+                self.assertTrue('a' in s)
+                self.assertFalse('c' in s or 0 in s)
+                self.assertEqual(
+                        list(s['b']),
+                        [IdRange(10, 10), IdRange(40, 5)]
+                        )
+                self.assertEqual(len(s.get('empty')), 0)
+                self.assertIsNone(s.get('c'))
+                with self.assertRaises(KeyError):
+                    s['c']
+
+                for subid in (9, 10, 17, 25, 42, (1 << 64) - 1, -1):
+                    self.assertEqual(s.who_has(subid), m.who_has(subid))
+
+            # Only the exporting process removes the segment
+            with self.assertRaises(ValueError):
+                attached.unlink()
+            attached.close()
+        finally:
+            shared.close()
+            shared.unlink()
+
+        with self.assertRaises(FileNotFoundError):
+            IdSharedMap(shared.name)
+
+    def test_close(self):
+
+        m = IdMap()
+        m.append('a')
+        m['a'].append(10, 5)
+
+        # Dropping a map without closing it detaches it from the segment
+        unraisable = []
+        hook = sys.unraisablehook
+        sys.unraisablehook = unraisable.append
+        try:
+            shared = IdSharedMap.export(m)
+            shm_name = shared.name
+            attached = IdSharedMap(shm_name)
+            shared.unlink()
+            del shared, attached
+            gc.collect()
+        finally:
+            sys.unraisablehook = hook
+        self.assertEqual(unraisable, [])
+        with self.assertRaises(FileNotFoundError):
+            IdSharedMap(shm_name)
+
+        # A with statement closes the map, closing it again does nothing
+        with IdSharedMap.export(m) as shared:
+            self.assertEqual(list(shared['a']), [IdRange(10, 5)])
+            with IdSharedMap(shared.name) as attached:
+                self.assertEqual(attached.who_has(12), ['a'])
+            shared.unlink()
+        shared.close()
+        attached.close()
+        with self.assertRaises(ValueError):
+            shared['a']